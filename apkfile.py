@@ -0,0 +1,174 @@
+"""Read InstallPack.apk from inside an xapk without loading it into memory"""
+
+from __future__ import annotations
+
+import contextlib
+import io
+import mmap
+import shutil
+import struct
+import tempfile
+import threading
+import zipfile
+from typing import IO, Iterator, Union
+import metrics
+
+INNER_APK = 'InstallPack.apk'
+COPY_CHUNK = 1024 * 1024
+# compressed members bigger than this are decompressed to a temporary file
+# and mapped rather than read into memory
+SPILL_SIZE = 16 * 1024 * 1024
+
+Buffer = Union[bytes, memoryview]
+
+
+class FileWindow(io.RawIOBase):
+    """
+    Read-only, seekable view of `length` bytes of `f` starting at `offset`.
+    `lock` is held while `f` is read, for when `f` is shared.
+    """
+
+    def __init__(self, f: IO[bytes], offset: int, length: int, lock: threading.Lock | None = None):
+        self.f = f
+        self.offset = offset
+        self.length = length
+        self.pos = 0
+        self.lock = lock or threading.Lock()
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def tell(self) -> int:
+        return self.pos
+
+    def seek(self, pos: int, whence: int = io.SEEK_SET) -> int:
+        if whence == io.SEEK_CUR:
+            pos += self.pos
+        elif whence == io.SEEK_END:
+            pos += self.length
+        self.pos = pos
+        return pos
+
+    def readinto(self, b) -> int:  # type: ignore
+        n = max(0, min(len(b), self.length - self.pos))
+        with self.lock:
+            self.f.seek(self.offset + self.pos)
+            n = self.f.readinto(memoryview(b)[:n])  # type: ignore
+        self.pos += n
+        return n
+
+
+def data_offset(f: IO[bytes], info: zipfile.ZipInfo, base: int = 0) -> int:
+    """
+    Where the data of `info` starts in `f`, read from its local header.
+    `base` is where the zip itself starts in `f`.
+    """
+    f.seek(base + info.header_offset)
+    header = f.read(30)
+    name_length, extra_length = struct.unpack('<HH', header[26:30])
+    return base + info.header_offset + 30 + name_length + extra_length
+
+
+class InnerApk:
+    """
+    The inner apk as `zip`, backed by `length` bytes of `file` from `base`
+    onwards. Members stored without compression can be mapped straight out
+    of `file` by `member`. Every read of `file` goes through `lock`, so
+    members can be read from several threads at once.
+    """
+
+    def __init__(self, file: IO[bytes], base: int, length: int):
+        self.file = file
+        self.base = base
+        self.lock = threading.Lock()
+        self.zip = zipfile.ZipFile(FileWindow(file, base, length, self.lock))
+        self.map: mmap.mmap | None = None
+
+    def stored_view(self, info: zipfile.ZipInfo) -> memoryview:
+        """A view of the data of `info`, which must be stored, in a mapping of the file."""
+        with self.lock:
+            if self.map is None:
+                self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+            start = data_offset(self.file, info, self.base)
+        return memoryview(self.map)[start : start + info.file_size]
+
+    @contextlib.contextmanager
+    def member(self, info: zipfile.ZipInfo) -> Iterator[Buffer]:
+        """
+        Content of `info`, only valid inside the `with` block: a view into a
+        mapping of the file if it is stored, otherwise the decompressed bytes,
+        or a mapping of a temporary file they are decompressed to if there are
+        more than SPILL_SIZE of them.
+        """
+        if info.file_size == 0:
+            yield b''
+            return
+
+        if info.compress_type == zipfile.ZIP_STORED:
+            with metrics.span('zip read', info.filename) as span:
+                view = self.stored_view(info)
+                span.add(bytes=info.file_size, count=1)
+            try:
+                yield view
+            finally:
+                view.release()
+            return
+
+        if info.file_size <= SPILL_SIZE:
+            with metrics.span('zip read', info.filename) as span:
+                data = self.zip.read(info)
+                span.add(bytes=len(data), count=1)
+            yield data
+            return
+
+        with tempfile.TemporaryFile() as tmp:
+            with metrics.span('zip read', info.filename) as span, self.zip.open(info) as src:
+                shutil.copyfileobj(src, tmp, COPY_CHUNK)
+                tmp.flush()
+                span.add(bytes=info.file_size, count=1)
+            with mmap.mmap(tmp.fileno(), 0, access=mmap.ACCESS_READ) as spilled:
+                view = memoryview(spilled)
+                try:
+                    yield view
+                finally:
+                    view.release()
+
+    def extract(self, info: zipfile.ZipInfo, path: str):
+        """Write `info` to `path` a chunk at a time."""
+        with self.zip.open(info) as src, open(path, 'wb') as dst:
+            shutil.copyfileobj(src, dst, COPY_CHUNK)
+
+    def close(self):
+        self.zip.close()
+        if self.map is not None:
+            self.map.close()
+
+
+@contextlib.contextmanager
+def open_inner_apk(path: str) -> Iterator[InnerApk]:
+    """
+    Open the InstallPack.apk in the xapk at `path`. If it is stored without
+    compression it is read in place, otherwise it is decompressed to a
+    temporary file first.
+    """
+    with open(path, 'rb') as f, zipfile.ZipFile(f) as outer:
+        info = outer.getinfo(INNER_APK)
+        if info.compress_type == zipfile.ZIP_STORED:
+            inner = InnerApk(f, data_offset(f, info), info.file_size)
+            try:
+                yield inner
+            finally:
+                inner.close()
+            return
+
+        with tempfile.TemporaryFile() as tmp:
+            with outer.open(info) as src:
+                shutil.copyfileobj(src, tmp, COPY_CHUNK)
+            inner = InnerApk(tmp, 0, info.file_size)
+            try:
+                yield inner
+            finally:
+                inner.close()
@@ -0,0 +1,148 @@
+"""
+asyncio on top of `requests`: each request and each chunk of a body is
+read on a worker thread, so downloads can run together under
+`asyncio.gather` while `requests` does the HTTP, i.e. pooled keep-alive
+connections, redirects, proxies from HTTP(S)_PROXY and CA bundles from
+REQUESTS_CA_BUNDLE.
+
+`run` runs a coroutine on one event loop shared by the whole process, so
+blocking code on any thread can use the same pool of connections.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import json
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, AsyncIterator, Callable, Coroutine, TypeVar
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+T = TypeVar('T')
+
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+# what a dropped or stalled connection raises, while connecting or while
+# reading the body
+DROPPED = (requests.ConnectionError, requests.Timeout, requests.exceptions.ChunkedEncodingError)
+# every request and chunk being read holds a thread until it arrives
+WORKERS = 64
+
+
+def lower_keys(headers: Any) -> dict[str, str]:
+    return {key.lower(): value for key, value in headers.items()}
+
+
+class Response:
+    """
+    A `requests` response whose body is read on worker threads. Use it as
+    `async with` or call `close`, which gives the connection back to the
+    pool and frees up its place under the client's limit.
+    """
+
+    def __init__(self, response: requests.Response, release: Callable[[], None] | None = None):
+        self.response = response
+        self.url = response.url
+        self.status = response.status_code
+        self.headers = lower_keys(response.headers)
+        self.release = release
+
+    async def __aenter__(self) -> "Response":
+        return self
+
+    async def __aexit__(self, *_: Any):
+        self.close()
+
+    async def iter_chunks(self, chunk_size: int = 64 * 1024) -> AsyncIterator[bytes]:
+        """The body, at most `chunk_size` bytes at a time."""
+        chunks = self.response.iter_content(chunk_size=chunk_size)
+        while True:
+            chunk = await asyncio.to_thread(next, chunks, None)
+            if chunk is None:
+                break
+            yield chunk
+
+    async def read(self) -> bytes:
+        return await asyncio.to_thread(lambda: self.response.content)
+
+    async def text(self) -> str:
+        return await asyncio.to_thread(lambda: self.response.text)
+
+    async def json(self) -> Any:
+        return json.loads(await self.read())
+
+    def close(self):
+        self.response.close()
+        if self.release is not None:
+            self.release()
+            self.release = None
+
+
+class AsyncClient:
+    """
+    GET requests through a `requests.Session`, at most `limit` at once, each
+    giving up after `timeout` seconds without data. The default session
+    retries failed connections and 429/5xx responses `retries` times,
+    waiting `backoff` seconds and doubling each time (or as long as a
+    Retry-After header says). `session` can be one that does more, e.g. a
+    cloudscraper one for sites behind cloudflare.
+    """
+
+    def __init__(
+        self,
+        session: requests.Session | None = None,
+        limit: int = 16,
+        timeout: float = 30.0,
+        retries: int = 3,
+        backoff: float = 0.5,
+        headers: dict[str, str] | None = None,
+    ):
+        if session is None:
+            session = requests.Session()
+            retry = Retry(total=retries, backoff_factor=backoff, status_forcelist=RETRY_STATUSES, raise_on_status=False)
+            adapter = HTTPAdapter(pool_connections=limit, pool_maxsize=limit, max_retries=retry)
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+            # sizes are checked against content-length, which is before decoding
+            session.headers['Accept-Encoding'] = 'identity'
+        session.headers.update(headers or {})
+        self.session = session
+        self.limit = limit
+        self.timeout = timeout
+        self.semaphore: asyncio.Semaphore | None = None
+
+    async def get(self, url: str, headers: dict[str, str] | None = None) -> Response:
+        """Request `url`, following redirects. The body isn't read yet."""
+        if self.semaphore is None:
+            self.semaphore = asyncio.Semaphore(self.limit)
+        await self.semaphore.acquire()
+        try:
+            response = await asyncio.to_thread(
+                self.session.get, url, headers=headers, stream=True, timeout=self.timeout
+            )
+        except BaseException:
+            self.semaphore.release()
+            raise
+        return Response(response, self.semaphore.release)
+
+    def close(self):
+        self.session.close()
+
+
+loop: asyncio.AbstractEventLoop | None = None
+loop_lock = threading.Lock()
+
+
+def run(coroutine: Coroutine[Any, Any, T]) -> T:
+    """
+    Run `coroutine` on the shared event loop, started on a background thread
+    the first time, and wait for its result.
+    """
+    global loop
+    with loop_lock:
+        if loop is None:
+            loop = asyncio.new_event_loop()
+            loop.set_default_executor(ThreadPoolExecutor(WORKERS, thread_name_prefix='asynchttp'))
+            threading.Thread(target=loop.run_forever, name='asynchttp', daemon=True).start()
+    return asyncio.run_coroutine_threadsafe(coroutine, loop).result()
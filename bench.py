@@ -0,0 +1,505 @@
+"""
+Benchmarks for the hot paths of download, extract and decrypt, run against
+synthetic fixtures so no real apk is needed.
+
+    python bench.py [--sizes 8,64] [--output results.json] [--compare old.json]
+    python bench.py --cipher
+    python bench.py --imports
+    python bench.py --html [<saved page>...]
+
+Each case runs in its own process so its peak RSS can be measured.
+"""
+
+from __future__ import annotations
+
+import http.server
+import io
+import json
+import os
+import random
+import re
+import runpy
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import timeit
+import zipfile
+from typing import Any, Callable
+from Crypto.Cipher import AES
+from Crypto.Util.Padding import pad
+import htmlscan
+from core import CountryCode, pop_option
+from download import download_ranged
+from decrypt import (
+    decrypt_pack,
+    decryptfile,
+    get_key_iv_from_cc,
+    get_pack_cipher,
+    map_file,
+    md5_str,
+    open_file_b,
+    remove_pkcs7_padding,
+    unpack_list,
+    unpack_pack,
+)
+
+CC = CountryCode.EN
+VERSION = 'en-99.0'
+# share of the total size and typical entry size of each fixture pack
+PACKS = {
+    'DataLocal': (0.5, 8 * 1024),
+    'ImageDataLocal': (0.3, 64 * 1024),
+    'resLocal': (0.15, 2 * 1024),
+    'Server_Bench': (0.05, 16 * 1024),
+}
+
+
+def legacy_decrypt_pack(chunk_data: bytes, cc: CountryCode, pack_name: str) -> bytes:
+    """`decrypt_pack` as it was before the cipher setup was cached."""
+    if "server" in pack_name.lower():
+        cipher = AES.new(md5_str("battlecats"), AES.MODE_ECB)
+    else:
+        skey, siv = get_key_iv_from_cc(cc)
+        cipher = AES.new(bytes.fromhex(skey), AES.MODE_CBC, bytes.fromhex(siv))
+    return remove_pkcs7_padding(cipher.decrypt(chunk_data))  # type: ignore
+
+
+def bench_cipher(sizes: tuple[int, ...] = (16, 1024, 16 * 1024, 1024 * 1024), repeat: int = 5):
+    """Time per entry of `decrypt_pack` before and after, for each entry size."""
+    print(f"{'pack':<10} {'entry size':>10} {'before':>10} {'after':>10}")
+    for pack_name in ("DataLocal", "Server"):
+        for size in sizes:
+            chunk = os.urandom(size)
+            number = max(10, 2_000_000 // (size + 1000))
+            before = min(timeit.repeat(
+                lambda: legacy_decrypt_pack(chunk, CountryCode.EN, pack_name), number=number, repeat=repeat
+            )) / number
+            after = min(timeit.repeat(
+                lambda: decrypt_pack(chunk, CountryCode.EN, pack_name), number=number, repeat=repeat
+            )) / number
+            print(f"{pack_name:<10} {size:>10} {before * 1e6:>8.1f}us {after * 1e6:>8.1f}us")
+
+
+################################################################################
+# Fixtures
+################################################################################
+
+def legacy_apkpure_versions(html: str) -> list[str]:
+    """How apkpure versions pages were read before `htmlscan`."""
+    versions: list[str] = []
+    for ls in re.findall(r'<ul[^>]*ver-wrap[^>]*>(?:.|\n)*?</ul>', html):
+        for item in re.findall(r'<li[^>]*>(?:.|\n)*?</li>', ls):
+            link_s = re.search(r'<a(?:[^>]|\n)*>', item)
+            if not link_s:
+                continue
+            ver = re.search(r'data-dt-version="([^"]*)"', link_s.group(0))
+            if not ver:
+                raise ValueError('interface changed; code needs to be updated')
+            versions.append(ver.group(1))
+    return versions
+
+
+def legacy_attribute_after(html: str, marker: str, attribute: str) -> str:
+    """How uptodown pages were read before `htmlscan`."""
+    data = html[html.find(marker):]
+    code = f'{attribute}="'
+    data = data[data.find(code) + len(code):]
+    return data[:data.find('"')]
+
+
+def make_apkpure_page(versions: int, filler: int = 200, close_items: bool = True) -> str:
+    """
+    A versions page shaped like apkpure's, with `filler` unrelated blocks
+    around the list. Without `close_items` the `<li>`s have no end tags,
+    which is valid HTML.
+    """
+    rnd = random.Random(0)
+    noise = ''.join(
+        f'<div class="box c{i}">\n  <p>{"lorem ipsum " * rnd.randint(1, 30)}</p>\n  <a href="/x/{i}">link</a>\n</div>\n'
+        for i in range(filler)
+    )
+    items = ''.join(
+        f'<li>\n  <a class="ver_download_link" href="/v/{i}"\n     data-dt-version="{i // 100}.{i % 100}.0" data-dt-versioncode="{i}">\n'
+        f'    <div class="ver-item"><span>{i // 100}.{i % 100}.0</span><span>XAPK</span></div>\n  </a>\n'
+        + ('</li>\n' if close_items else '')
+        for i in range(versions)
+    )
+    return f'<html><head><title>Versions</title></head><body>\n{noise}<ul class="ver-wrap">\n{items}</ul>\n{noise}</body></html>'
+
+
+def make_uptodown_page(marker: str, attribute: str, filler: int = 200) -> str:
+    rnd = random.Random(0)
+    noise = ''.join(
+        f'<section id="s{i}" data-x="{i}"><p>{"dolor sit amet " * rnd.randint(1, 30)}</p></section>\n' for i in range(filler)
+    )
+    return f'<html><body>{noise}<div id="{marker}" {attribute}="1234567">x</div>{noise}</body></html>'
+
+
+PAGES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'tests', 'pages')
+
+
+def page_extractors(page: str) -> tuple[Callable[[], Any], Callable[[], Any]]:
+    """The old way and the `htmlscan` way of reading what download needs out of `page`."""
+    if 'ver-wrap' in page:
+        return (
+            lambda: legacy_apkpure_versions(page),
+            lambda: htmlscan.parse_page(htmlscan.ApkpureVersions(), page).versions,
+        )
+    marker, attribute = (
+        ('detail-download-button', 'data-url') if 'detail-download-button' in page else ('detail-app-name', 'data-code')
+    )
+    return (
+        lambda: legacy_attribute_after(page, marker, attribute),
+        lambda: htmlscan.parse_page(htmlscan.AttributeAfter(marker, attribute), page).value,
+    )
+
+
+def bench_html(paths: list[str], repeat: int = 5):
+    """
+    Time reading versions and links out of pages, with the old regexes and
+    slicing against `htmlscan`. Uses `paths` (pages saved from a browser) if
+    given, otherwise the hand-built fixture pages in tests/pages and
+    synthetic pages of a few sizes.
+    """
+    if not paths:
+        paths = sorted(os.path.join(PAGES_DIR, name) for name in os.listdir(PAGES_DIR))
+        synthetic = True
+    else:
+        synthetic = False
+    pages: list[tuple[str, str]] = []
+    for path in paths:
+        with open(path, encoding='utf-8', errors='replace') as f:
+            pages.append((os.path.basename(path), f.read()))
+    if synthetic:
+        pages += [(f'apkpure {n} versions', make_apkpure_page(n)) for n in (50, 500, 2000)]
+        pages += [('apkpure unclosed <li>', make_apkpure_page(500, close_items=False))]
+        pages += [('uptodown app', make_uptodown_page('detail-app-name', 'data-code'))]
+        pages += [('uptodown download', make_uptodown_page('detail-download-button', 'data-url'))]
+
+    print(f"{'page':<24} {'size':>10} {'before':>10} {'after':>10}")
+    for name, page in pages:
+        before, after = page_extractors(page)
+        if before() != after():
+            print(f'{name}: results differ')
+        number = max(1, 2_000_000 // len(page))
+        before_time = min(timeit.repeat(before, number=number, repeat=repeat)) / number
+        after_time = min(timeit.repeat(after, number=number, repeat=repeat)) / number
+        print(f"{name:<24} {len(page):>10} {before_time * 1e3:>8.2f}ms {after_time * 1e3:>8.2f}ms")
+
+
+IMPORT_MODULES = ('core', 'metrics', 'listindex', 'csvtable', 'apkfile', 'decrypt', 'versionfs', 'asynchttp', 'download')
+# imported lazily, so none of these should be loaded by just importing decrypt
+HEAVY_MODULES = ('Crypto', 'requests', 'asyncio', 'ssl', 'sqlite3')
+
+
+def bench_imports(repeat: int = 20):
+    """
+    Time a fresh interpreter importing each module, less the time of one
+    that imports nothing, i.e. what each short-lived process pays up front.
+    """
+    here = os.path.dirname(os.path.abspath(__file__))
+
+    def best(code: str) -> float:
+        times = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            subprocess.run([sys.executable, '-c', code], cwd=here, check=True)
+            times.append(time.perf_counter() - start)
+        return min(times)
+
+    baseline = best('pass')
+    print(f"{'module':<12} {'import':>10}  also loads")
+    for module in IMPORT_MODULES:
+        took = best(f'import {module}')
+        loaded = subprocess.run(
+            [sys.executable, '-c', f'import sys, {module}; print(*(m for m in {HEAVY_MODULES!r} if m in sys.modules))'],
+            cwd=here,
+            check=True,
+            capture_output=True,
+            text=True,
+        ).stdout.strip()
+        print(f"{module:<12} {(took - baseline) * 1000:>8.1f}ms  {loaded}")
+
+
+def make_pack(base_name: str, cc: CountryCode, total: int, entry_size: int, seed: int = 0) -> tuple[bytes, bytes]:
+    """
+    An encrypted .list/.pack pair of roughly `total` bytes, encrypted the
+    same way as the game's so `decryptfile` can read it.
+    """
+    rnd = random.Random(seed)
+    cipher = get_pack_cipher(cc, base_name)
+    lines: list[str] = []
+    pack = io.BytesIO()
+    while pack.tell() < total:
+        data = rnd.randbytes(rnd.randint(entry_size // 2, entry_size * 3 // 2))
+        if cipher.passthrough:
+            chunk = data
+        elif cipher.iv is None:
+            chunk = AES.new(cipher.key, AES.MODE_ECB).encrypt(pad(data, 16))
+        else:
+            chunk = AES.new(cipher.key, AES.MODE_CBC, cipher.iv).encrypt(pad(data, 16))
+        lines.append(f'{len(lines):06d}.csv,{pack.tell()},{len(chunk)}\n')
+        pack.write(chunk)
+
+    list_data = f'{len(lines)}\n' + ''.join(lines)
+    list_raw = AES.new(md5_str("pack"), AES.MODE_ECB).encrypt(pad(list_data.encode('utf-8'), 16))
+    return list_raw, pack.getvalue()
+
+
+def make_assets(folder: str, total: int, cc: CountryCode = CC):
+    """An extracted apk in `folder`, i.e. `folder/assets/*.list|pack`."""
+    os.makedirs(os.path.join(folder, 'assets'), exist_ok=True)
+    for seed, (name, (share, entry_size)) in enumerate(PACKS.items()):
+        list_raw, pack_raw = make_pack(name, cc, int(total * share), entry_size, seed)
+        with open(os.path.join(folder, 'assets', f'{name}.list'), 'wb') as f:
+            f.write(list_raw)
+        with open(os.path.join(folder, 'assets', f'{name}.pack'), 'wb') as f:
+            f.write(pack_raw)
+
+
+def make_apk(path: str, folder: str):
+    """An xapk at `path` with the assets of `folder` in its InstallPack.apk."""
+    inner_path = path + '.inner'
+    with zipfile.ZipFile(inner_path, 'w', zipfile.ZIP_STORED) as inner:
+        inner.writestr('AndroidManifest.xml', b'')
+        for fname in sorted(os.listdir(os.path.join(folder, 'assets'))):
+            inner.write(os.path.join(folder, 'assets', fname), f'assets/{fname}')
+    with zipfile.ZipFile(path, 'w', zipfile.ZIP_STORED) as outer:
+        outer.writestr('manifest.json', b'{}')
+        outer.write(inner_path, 'InstallPack.apk')
+    os.remove(inner_path)
+
+
+class FileHandler(http.server.BaseHTTPRequestHandler):
+    """
+    Serves `path` at every url, honouring Range like the uptodown CDN, or
+    with `ranges` off sending the whole file anyway while still claiming to
+    accept ranges, like a server that rejects them.
+    """
+
+    path_to_serve = ''
+    ranges = True
+
+    def log_message(self, *_: Any):
+        pass
+
+    def do_GET(self):
+        size = os.path.getsize(self.path_to_serve)
+        start, end = 0, size - 1
+        match = re.match(r'bytes=(\d+)-(\d*)', self.headers.get('Range', ''))
+        if match and self.ranges:
+            start = int(match.group(1))
+            end = int(match.group(2)) if match.group(2) else end
+            self.send_response(206)
+            self.send_header('Content-Range', f'bytes {start}-{end}/{size}')
+        else:
+            self.send_response(200)
+        self.send_header('Accept-Ranges', 'bytes')
+        self.send_header('Content-Length', str(end - start + 1))
+        self.end_headers()
+
+        with open(self.path_to_serve, 'rb') as f:
+            f.seek(start)
+            remaining = end - start + 1
+            while remaining:
+                chunk = f.read(min(remaining, 1024 * 1024))
+                self.wfile.write(chunk)
+                remaining -= len(chunk)
+
+
+def serve_file(path: str, ranges: bool = True) -> tuple[http.server.ThreadingHTTPServer, str]:
+    """A local stand-in for the download server. Returns it and its url."""
+    handler = type('Handler', (FileHandler,), {'path_to_serve': path, 'ranges': ranges})
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f'http://127.0.0.1:{server.server_port}/{os.path.basename(path)}'
+
+
+################################################################################
+# Cases, each run in a fresh process inside the fixture folder
+################################################################################
+
+def pack_stats(names: list[str]) -> tuple[int, int]:
+    """Total bytes and files in the packs `names` of the fixture."""
+    total, files = 0, 0
+    for name in names:
+        total += os.path.getsize(os.path.join(VERSION, 'assets', f'{name}.pack'))
+        list_data = unpack_list(open_file_b(os.path.join(VERSION, 'assets', f'{name}.list')))
+        files += int(list_data.split(b'\n', 1)[0])
+    return total, files
+
+
+def run_script(path: str, *args: str):
+    argv = sys.argv
+    sys.argv = [path, *args]
+    try:
+        runpy.run_path(path, run_name='__main__')
+    finally:
+        sys.argv = argv
+
+
+def case_unpack_pack(url: str) -> tuple[int, int, float]:
+    list_data = unpack_list(open_file_b(os.path.join(VERSION, 'assets', 'DataLocal.list'))).decode('utf-8')
+    targ_base_path = os.path.join('data', 'decrypted', VERSION, 'DataLocal')
+    os.makedirs(targ_base_path)
+    with map_file(os.path.join(VERSION, 'assets', 'DataLocal.pack')) as pack_data:
+        start = time.perf_counter()
+        unpack_pack(list_data, pack_data, 'DataLocal', CC, targ_base_path)
+        took = time.perf_counter() - start
+    return (*pack_stats(['DataLocal']), took)
+
+
+def case_decryptfile(url: str) -> tuple[int, int, float]:
+    start = time.perf_counter()
+    for name in PACKS:
+        list_data = open_file_b(os.path.join(VERSION, 'assets', f'{name}.list'))
+        with map_file(os.path.join(VERSION, 'assets', f'{name}.pack')) as pack_data:
+            decryptfile(list_data, pack_data, name, CC, os.path.join('data', 'decrypted', VERSION, name))
+    return (*pack_stats(list(PACKS)), time.perf_counter() - start)
+
+
+def case_extract(url: str) -> tuple[int, int, float]:
+    here = os.path.dirname(os.path.abspath(__file__))
+    start = time.perf_counter()
+    run_script(os.path.join(here, 'extract.py'), f'{VERSION}.apk')
+    took = time.perf_counter() - start
+    files = len(os.listdir(os.path.join(VERSION, 'assets')))
+    return os.path.getsize(f'{VERSION}.apk'), files, took
+
+
+def case_simpleapk(url: str) -> tuple[int, int, float]:
+    here = os.path.dirname(os.path.abspath(__file__))
+    start = time.perf_counter()
+    run_script(os.path.join(here, 'simpleapk.py'), f'{VERSION}.apk', '--use-all-langs')
+    return (*pack_stats(list(PACKS)), time.perf_counter() - start)
+
+
+def case_download_stream(url: str) -> tuple[int, int, float]:
+    start = time.perf_counter()
+    download_ranged(url, os.path.abspath(os.path.join('data', 'apk', 'download.apk')))
+    return os.path.getsize(f'{VERSION}.apk'), 1, time.perf_counter() - start
+
+
+CASES: dict[str, Callable[[str], tuple[int, int, float]]] = {
+    'unpack_pack': case_unpack_pack,
+    'decryptfile': case_decryptfile,
+    'extract': case_extract,
+    'simpleapk': case_simpleapk,
+    'download_stream': case_download_stream,
+}
+
+
+def peak_rss() -> int | None:
+    """Peak resident memory of this process in bytes, if it can be found."""
+    # VmHWM starts again on exec, unlike ru_maxrss which a child inherits
+    if os.path.exists('/proc/self/status'):
+        with open('/proc/self/status', encoding='utf-8') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) * 1024
+    try:
+        import resource
+    except ImportError:
+        return None
+    # kilobytes on linux, bytes on macos
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * (1 if sys.platform == 'darwin' else 1024)
+
+
+def run_case(case: str, folder: str, url: str) -> dict[str, Any]:
+    """Run `case` in a child process, so its peak RSS is its own."""
+    result_path = os.path.join(folder, 'result.json')
+    code = subprocess.call(
+        [sys.executable, os.path.abspath(__file__), '--run', case, result_path, url],
+        cwd=folder,
+        stdout=subprocess.DEVNULL,
+    )
+    if code != 0:
+        raise RuntimeError(f'{case} failed with exit code {code}')
+
+    with open(result_path, encoding='utf-8') as f:
+        total, files, seconds, rss = json.load(f)
+    os.remove(result_path)
+    shutil.rmtree(os.path.join(folder, 'data'), ignore_errors=True)
+    return {
+        'case': case,
+        'bytes': total,
+        'files': files,
+        'seconds': seconds,
+        'mb_per_s': total / seconds / 1e6,
+        'files_per_s': files / seconds,
+        'peak_rss': rss,
+    }
+
+
+def run_benchmarks(sizes_mb: list[int]) -> list[dict[str, Any]]:
+    results: list[dict[str, Any]] = []
+    for size_mb in sizes_mb:
+        with tempfile.TemporaryDirectory() as folder:
+            make_assets(os.path.join(folder, VERSION), size_mb * 1000 * 1000)
+            make_apk(os.path.join(folder, f'{VERSION}.apk'), os.path.join(folder, VERSION))
+            server, url = serve_file(os.path.join(folder, f'{VERSION}.apk'))
+            try:
+                for case in CASES:
+                    result = run_case(case, folder, url)
+                    result['size_mb'] = size_mb
+                    results.append(result)
+                    print_result(result)
+            finally:
+                server.shutdown()
+    return results
+
+
+def print_result(result: dict[str, Any], old: dict[str, Any] | None = None):
+    rss = f"{result['peak_rss'] / 2**20:.1f} MiB" if result['peak_rss'] is not None else '?'
+    line = (
+        f"{result['case']:<16} {result['size_mb']:>5} MB {result['mb_per_s']:>9.1f} MB/s "
+        f"{result['files_per_s']:>10.0f} files/s {rss:>12} peak RSS"
+    )
+    if old is not None:
+        line += f" ({(result['mb_per_s'] / old['mb_per_s'] - 1) * 100:+.1f}% MB/s)"
+    print(line)
+
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+    if args[:1] == ['--run']:
+        # inside the child process of `run_case`
+        _, case, result_path, url = args
+        result = CASES[case](url)
+        with open(result_path, 'w', encoding='utf-8') as f:
+            json.dump([*result, peak_rss()], f)
+        quit()
+
+    if '--cipher' in args:
+        bench_cipher()
+        quit()
+
+    if '--imports' in args:
+        bench_imports()
+        quit()
+
+    if '--html' in args:
+        args.remove('--html')
+        bench_html(args)
+        quit()
+
+    sizes_mb = [int(size) for size in pop_option(args, '--sizes', '8,64').split(',')]  # type: ignore
+    output = pop_option(args, '--output')
+    compare = pop_option(args, '--compare')
+
+    results = run_benchmarks(sizes_mb)
+
+    if compare is not None:
+        with open(compare, encoding='utf-8') as f:
+            old_results = {(r['case'], r['size_mb']): r for r in json.load(f)}
+        print(f'\nCompared with {compare}:')
+        for result in results:
+            print_result(result, old_results.get((result['case'], result['size_mb'])))
+
+    if output is not None:
+        with open(output, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+        print(f'Results written to {output}')
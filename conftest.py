@@ -0,0 +1 @@
+"""Lets the tests in tests/ import the scripts at the top level."""
@@ -0,0 +1,94 @@
+"""
+What every script needs, using only the standard library so it is quick to
+import: country codes and their keys, and reading options from `sys.argv`.
+Progress bars and timings are in `metrics`.
+"""
+
+from __future__ import annotations
+
+import enum
+import hashlib
+from typing import Literal
+
+
+# https://codeberg.org/fieryhenry/tbcml/src/branch/master/src/tbcml/country_code.py
+class CountryCode(enum.Enum):
+    """Country code enum."""
+
+    EN = "en"
+    JP = "jp"
+    KR = "kr"
+    TW = "tw"
+
+    @staticmethod
+    def from_cc(cc: str | Literal["en"] | Literal["jp"] | Literal["kr"] | Literal["tw"] | CountryCode):
+        if isinstance(cc, str):
+            return CountryCode.from_code(cc)
+        return cc
+
+    @staticmethod
+    def from_code(code: str) -> CountryCode:
+        map = {
+            "ja": "jp",
+            "ko": "kr",
+        }
+        # alternative names for these codes
+        codel = code.lower()
+        if codel in map:
+            codel = map[codel]
+        for country_code in CountryCode:
+            if country_code.value == codel:
+                return country_code
+
+        raise ValueError(f'{code!r} is not a valid country code!')
+
+    def get_patch_code(self) -> str:
+        """For apkpure"""
+        if self == CountryCode.JP:
+            return ""
+        else:
+            return self.value
+
+    def __str__(self):
+        return self.value
+
+
+def md5_str(string: str, length: int=8) -> bytes:
+    return (
+        bytearray(hashlib.md5(string.encode("utf-8")).digest()[:length])
+        .hex()
+        .encode("utf-8")
+    )
+
+# https://codeberg.org/fieryhenry/tbcml/src/branch/master/src/tbcml/crypto.py
+# https://codeberg.org/fieryhenry/tbcml/src/commit/4eede7d7af9b770dceb08ef6313f62aabe2fc45d/src/tbcml/crypto.py#L139
+
+def get_key_iv_from_cc(cc: CountryCode) -> tuple[str, str]:
+    if cc == CountryCode.JP:
+        key = "d754868de89d717fa9e7b06da45ae9e3"
+        iv = "40b2131a9f388ad4e5002a98118f6128"
+    elif cc == CountryCode.EN:
+        key = "0ad39e4aeaf55aa717feb1825edef521"
+        iv = "d1d7e708091941d90cdf8aa5f30bb0c2"
+    elif cc == CountryCode.KR:
+        key = "bea585eb993216ef4dcb88b625c3df98"
+        iv = "9b13c2121d39f1353a125fed98696649"
+    elif cc == CountryCode.TW:
+        key = "313d9858a7fb939def1d7d859629087d"
+        iv = "0e3743eb53bf5944d1ae7e10c2e54bdf"
+    else:
+        raise ValueError("Unknown country code")
+    return key, iv
+
+
+def pop_option(argv: list[str], name: str, default: str | None = None) -> str | None:
+    """Remove `name value` or `name=value` from `argv` and return the value."""
+    for i, arg in enumerate(argv):
+        if arg == name:
+            value = argv[i + 1]
+            del argv[i:i + 2]
+            return value
+        if arg.startswith(name + '='):
+            del argv[i]
+            return arg[len(name) + 1:]
+    return default
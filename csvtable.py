@@ -0,0 +1,225 @@
+"""
+Parsing for the decrypted game CSVs (e.g. DataLocal/unit001.csv), either
+lazily a row at a time or into a `Table` of typed columns that is cached
+on disk by the hash of the file, so reading the same file again is one
+read of a compact binary file.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import io
+import os
+import struct
+import sys
+from array import array
+from typing import Container, Iterable, Iterator, Optional, Union
+
+CSV_CACHE_DIR = './data/cache/csv'
+MAGIC = b'MBCT'
+HEADER = struct.Struct('<4sIQQ')
+COLUMN = struct.Struct('<cQ')
+# part of the cache key, so tables parsed differently by older code aren't used
+PARSER_VERSION = 2
+
+Column = Union[array, list]
+Cell = Union[int, str]
+
+
+def filter_fields(fields: list[str], blacklist: Container[str]) -> list[str]:
+    """`fields` without those in `blacklist`, ignoring the line ending of the last one."""
+    return [field for field in fields if field.rstrip('\r\n') not in blacklist]
+
+
+def iter_csv_rows(
+    path: Optional[str] = None,
+    lines: Optional[Iterable[str]] = None,
+    min_length: int = 0,
+    blacklist: Optional[Iterable[str]] = None,
+    delimiter: str = ',',
+) -> Iterator[list[str]]:
+    """
+    The fields of each line of `lines`, or of the file at `path` read a line
+    at a time, skipping lines with fewer than `min_length` fields. Lines are
+    split as they are, so the last field keeps its line ending.
+    """
+    blacklist = frozenset(blacklist or ())
+    if lines is None:
+        if not path:
+            raise ValueError('Attempting to parse csv file that cannot be read')
+        with open(path, 'r', encoding='utf-8') as f:
+            yield from iter_csv_rows(None, f, min_length, blacklist, delimiter)
+        return
+
+    for line in lines:
+        fields = line.split(delimiter)
+        if len(fields) < min_length:
+            continue
+        if blacklist:
+            fields = filter_fields(fields, blacklist)
+        yield fields
+
+
+INT_TYPES = [('b', 1 << 7), ('h', 1 << 15), ('i', 1 << 31), ('q', 1 << 63)]
+
+
+def narrowest(numbers: array) -> array:
+    """`numbers` in the smallest array type that holds all of them."""
+    low, high = min(numbers, default=0), max(numbers, default=0)
+    for typecode, limit in INT_TYPES:
+        if -limit <= low and high < limit:
+            return numbers if numbers.typecode == typecode else array(typecode, numbers)
+    return numbers
+
+
+def int_column(cells: list[str]) -> Optional[array]:
+    """`cells` as an int array if every one is an int written the usual way, e.g. not `007`."""
+    try:
+        column = array('q', map(int, cells))
+    except (ValueError, OverflowError):
+        return None
+    if list(map(str, column)) != cells:
+        return None
+    return narrowest(column)
+
+
+class Table:
+    """
+    A CSV file as columns: an int `array` for a column where every cell is
+    an int, otherwise a list of interned strings. Blank lines are skipped and
+    rows can have different lengths, `lengths[i]` cells for row `i`. Cells
+    past the end of a row read as 0 or '' in `columns`.
+    """
+
+    def __init__(self, lengths: array, columns: list[Column]):
+        self.lengths = lengths
+        self.columns = columns
+
+    @staticmethod
+    def parse(
+        text: str, delimiter: str = ',', min_length: int = 0, blacklist: Optional[Iterable[str]] = None
+    ) -> "Table":
+        """
+        Parse `text` with the same options as `iter_csv_rows`, split into
+        lines the same way as reading the file, but without line endings.
+        """
+        # unlike str.splitlines, this only splits on \n, \r\n and \r like open
+        lines = (line.rstrip('\n') for line in io.StringIO(text, newline=None))
+        rows = list(iter_csv_rows(lines=filter(None, lines), min_length=min_length, blacklist=blacklist, delimiter=delimiter))
+        width = max(map(len, rows), default=0)
+        lengths = array('l', map(len, rows))
+        columns: list[Column] = []
+        if all(length == width for length in lengths):
+            split = [(cells, cells) for cells in map(list, zip(*rows))]
+        else:
+            split = [
+                ([row[j] if j < len(row) else '' for row in rows], [row[j] for row in rows if j < len(row)])
+                for j in range(width)
+            ]
+        for cells, present in split:
+            numbers = int_column(present)
+            if numbers is None:
+                columns.append([sys.intern(cell) for cell in cells])
+            elif len(present) == len(cells):
+                columns.append(numbers)
+            else:
+                columns.append(array(numbers.typecode, (int(cell) if cell else 0 for cell in cells)))
+        return Table(lengths, columns)
+
+    def __len__(self) -> int:
+        return len(self.lengths)
+
+    def row(self, i: int) -> list[Cell]:
+        return [column[i] for column in self.columns[: self.lengths[i]]]
+
+    def __iter__(self) -> Iterator[list[Cell]]:
+        return (self.row(i) for i in range(len(self.lengths)))
+
+    def column(self, j: int) -> Column:
+        return self.columns[j]
+
+    def is_numeric(self, j: int) -> bool:
+        return isinstance(self.columns[j], array)
+
+    def to_bytes(self) -> bytes:
+        """
+        `MBCT`, a format version, the number of rows and columns, then the row
+        lengths as little-endian int32s, then each column: the typecode of its
+        array and the ints, or `s` and its strings separated by newlines.
+        """
+        lengths = array('i', self.lengths)
+        if sys.byteorder == 'big':
+            lengths.byteswap()
+        parts = [HEADER.pack(MAGIC, 1, len(self.lengths), len(self.columns)), lengths.tobytes()]
+        for column in self.columns:
+            if isinstance(column, array):
+                numbers = array(column.typecode, column)
+                if sys.byteorder == 'big':
+                    numbers.byteswap()
+                payload, kind = numbers.tobytes(), column.typecode.encode('ascii')
+            else:
+                payload, kind = '\n'.join(column).encode('utf-8'), b's'
+            parts += [COLUMN.pack(kind, len(payload)), payload]
+        return b''.join(parts)
+
+    @staticmethod
+    def from_bytes(data: bytes) -> "Table":
+        magic, version, rows, width = HEADER.unpack_from(data)
+        if magic != MAGIC or version != 1:
+            raise ValueError('not a parsed csv table')
+        pos = HEADER.size
+        lengths = array('i')
+        lengths.frombytes(data[pos : pos + 4 * rows])
+        pos += 4 * rows
+        if sys.byteorder == 'big':
+            lengths.byteswap()
+
+        columns: list[Column] = []
+        for _ in range(width):
+            kind, size = COLUMN.unpack_from(data, pos)
+            pos += COLUMN.size
+            payload = data[pos : pos + size]
+            pos += size
+            if kind != b's':
+                numbers = array(kind.decode('ascii'))
+                numbers.frombytes(payload)
+                if sys.byteorder == 'big':
+                    numbers.byteswap()
+                columns.append(numbers)
+            else:
+                columns.append([sys.intern(cell) for cell in payload.decode('utf-8').split('\n')] if rows else [])
+        return Table(array('l', lengths), columns)
+
+
+def load_table(
+    path: str,
+    delimiter: str = ',',
+    min_length: int = 0,
+    blacklist: Optional[Iterable[str]] = None,
+    cache_dir: Optional[str] = CSV_CACHE_DIR,
+) -> Table:
+    """
+    The `Table` of the CSV at `path`. It is cached in `cache_dir` under the
+    hash of the file's content and the parsing options, so an unchanged file
+    is never parsed twice, whatever version or path it is at.
+    """
+    with open(path, 'rb') as f:
+        data = f.read()
+    if cache_dir is None:
+        return Table.parse(data.decode('utf-8'), delimiter, min_length, blacklist)
+
+    blacklist = list(blacklist or [])
+    key = hashlib.blake2b(data, digest_size=16)
+    key.update(repr((PARSER_VERSION, delimiter, min_length, blacklist)).encode('utf-8'))
+    cache_path = os.path.join(cache_dir, key.hexdigest() + '.table')
+    if os.path.exists(cache_path):
+        with open(cache_path, 'rb') as f:
+            return Table.from_bytes(f.read())
+
+    table = Table.parse(data.decode('utf-8'), delimiter, min_length, blacklist)
+    os.makedirs(cache_dir, exist_ok=True)
+    tmp = f'{cache_path}.{os.getpid()}.tmp'
+    with open(tmp, 'wb') as f:
+        f.write(table.to_bytes())
+    os.replace(tmp, cache_path)
+    return table
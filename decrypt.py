@@ -1,10 +1,26 @@
 #!/usr/bin/env python
+import contextlib
+import functools
 import hashlib
+import mmap
 import sys
 import os
-from Crypto.Cipher import AES
-from download import progress, CountryCode
-from typing import Optional
+import shutil
+import threading
+import time
+import traceback
+from collections import OrderedDict
+from apkfile import open_inner_apk
+from csvtable import iter_csv_rows
+import listindex
+from listindex import ListIndex
+import metrics
+from core import CountryCode, get_key_iv_from_cc, md5_str, pop_option
+from typing import IO, Callable, ContextManager, Iterator, NamedTuple, Optional, Union
+# pycryptodome, sqlite3 and thread pools are imported where they're used, so
+# this stays quick to import for scripts that only need part of it
+
+Buffer = Union[bytes, bytearray, memoryview, mmap.mmap]
 
 # this file is adapted from
 # https://codeberg.org/fieryhenry/BCGM-Python/src/branch/master/src/BCGM_Python/encrypt_decrypt/decrypt_pack.py
@@ -44,21 +60,30 @@ def open_file_b(path: str) -> bytes:
     with open(path, "rb") as f:
         return f.read()
 
-def remove_pkcs7_padding(data: bytes) -> bytes:
+@contextlib.contextmanager
+def map_file(path: str) -> Iterator[Buffer]:
+    """
+    Map `path` into memory read-only, so only the parts of it that are sliced
+    get read and the pages can be dropped again by the OS.
+    """
+    with open(path, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            # empty files cannot be mapped
+            yield b""
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+            yield m
+
+def remove_pkcs7_padding(data: Buffer) -> Buffer:
     if not data:
         return data
     padding = data[-1]
     return data[:-padding]
 
 
-def md5_str(string: str, length: int=8) -> bytes:
-    return (
-        bytearray(hashlib.md5(string.encode("utf-8")).digest()[:length])
-        .hex()
-        .encode("utf-8")
-    )
-
 def unpack_list(list_file_raw: bytes) -> bytes:
+    from Crypto.Cipher import AES
+
     key = md5_str("pack")
     cipher = AES.new(key, AES.MODE_ECB)
     decrypted_data = cipher.decrypt(list_file_raw)
@@ -66,102 +91,1142 @@ def unpack_list(list_file_raw: bytes) -> bytes:
     return decrypted_data
 
 def parse_csv_file(path: Optional[str], lines: Optional[list[str]] = None, min_length = 0, blacklist = None) -> list[list[str]]:
-    if not lines:
-        if not path:
-            raise ValueError('Attempting to parse csv file that cannot be read')
-        lines = open(path, "r", encoding="utf-8").readlines()
-
-    data: list[list[str]] = []
-    for line in lines:
-        line_data = line.split(",")
-        if len(line_data) < min_length:
-            continue
+    """
+    Every row of `lines` or of the file at `path`, leaving out fields that
+    are in `blacklist`. See `csvtable.load_table` for a typed, cached
+    version.
+    """
+    return list(iter_csv_rows(path, lines or None, min_length, blacklist))
 
-        if blacklist:
-            # line_data = filter_list(line_data, blacklist)
-            raise NotImplementedError
-
-        data.append(line_data)
-    return data
-
-# https://codeberg.org/fieryhenry/tbcml/src/branch/master/src/tbcml/crypto.py
-# https://codeberg.org/fieryhenry/tbcml/src/commit/4eede7d7af9b770dceb08ef6313f62aabe2fc45d/src/tbcml/crypto.py#L139
-
-def get_key_iv_from_cc(cc: CountryCode) -> tuple[str, str]:
-    if cc == CountryCode.JP:
-        key = "d754868de89d717fa9e7b06da45ae9e3"
-        iv = "40b2131a9f388ad4e5002a98118f6128"
-    elif cc == CountryCode.EN:
-        key = "0ad39e4aeaf55aa717feb1825edef521"
-        iv = "d1d7e708091941d90cdf8aa5f30bb0c2"
-    elif cc == CountryCode.KR:
-        key = "bea585eb993216ef4dcb88b625c3df98"
-        iv = "9b13c2121d39f1353a125fed98696649"
-    elif cc == CountryCode.TW:
-        key = "313d9858a7fb939def1d7d859629087d"
-        iv = "0e3743eb53bf5944d1ae7e10c2e54bdf"
-    else:
-        raise ValueError("Unknown country code")
-    return key, iv
+# below this many bytes CBC entries are xored as one integer
+CBC_ECB_THRESHOLD = 4096
 
-def decrypt_pack(chunk_data: bytes, cc: CountryCode, pack_name: str) -> bytes:
-    if "server" in pack_name.lower():
-        key = md5_str("battlecats")
-        aes_mode = AES.MODE_ECB
+class PackCipher:
+    """
+    Everything needed to decrypt the entries of one pack, worked out once:
+    server packs use ECB with a fixed key, other packs use CBC with the key of
+    their country code, and ImageDataLocal is not encrypted at all
+    (`passthrough`).
+    """
 
-        cipher = AES.new(key, aes_mode)
-    else:
-        aes_mode = AES.MODE_CBC
-        skey, siv = get_key_iv_from_cc(cc)
-        key, iv = bytes.fromhex(skey), bytes.fromhex(siv)
+    def __init__(self, cc: CountryCode, pack_name: str):
+        from Crypto.Cipher import AES
+        from Crypto.Util.strxor import strxor
 
-        cipher = AES.new(key, aes_mode, iv)
+        lower = pack_name.lower()
+        self.passthrough = "imagedatalocal" in lower
+        self.iv: Optional[bytes] = None
+        if "server" in lower:
+            self.key = md5_str("battlecats")
+        else:
+            skey, siv = get_key_iv_from_cc(cc)
+            self.key, self.iv = bytes.fromhex(skey), bytes.fromhex(siv)
+        # ECB keeps no state between calls, so this can be shared by every
+        # entry and thread
+        self.ecb = AES.new(self.key, AES.MODE_ECB)
+        # kept here since importing it per entry is slower than small entries
+        self.strxor = strxor
 
-    decrypted_data = cipher.decrypt(chunk_data)
-    decrypted_data = remove_pkcs7_padding(data=decrypted_data)
-    return decrypted_data
+    def decrypt(self, chunk_data: Buffer, output: Optional[memoryview] = None) -> Buffer:
+        strxor = self.strxor
+        if self.iv is None:
+            decrypted_data = self.ecb.decrypt(chunk_data, output=output)
+        elif len(chunk_data) < CBC_ECB_THRESHOLD:
+            # the same xor, but on small entries one integer xor is quicker
+            # than the memoryview slicing strxor needs
+            size = len(chunk_data)
+            xored = int.from_bytes(self.ecb.decrypt(chunk_data), 'big') ^ int.from_bytes(
+                self.iv + bytes(chunk_data[:-16]), 'big'
+            )
+            decrypted_data = xored.to_bytes(size, 'big')
+            if output is not None:
+                output[:] = decrypted_data
+        else:
+            # CBC decryption is ECB decryption xored with the previous block
+            # of ciphertext, and pycryptodome does bulk ECB far faster
+            if output is None:
+                output = memoryview(bytearray(len(chunk_data)))
+            chunk_view = memoryview(chunk_data)
+            self.ecb.decrypt(chunk_view, output=output)
+            strxor(output[16:], chunk_view[:-16], output=output[16:])
+            strxor(output[:16], self.iv, output=output[:16])
+            decrypted_data = None
+
+        if output is not None:
+            decrypted_data = output
+        return remove_pkcs7_padding(data=decrypted_data)  # type: ignore
+
+    def unpack(self, chunk_data: Buffer, output: Optional[memoryview] = None) -> Buffer:
+        """An entry as it should be written out, decrypted unless `passthrough`."""
+        if self.passthrough:
+            return chunk_data
+        return self.decrypt(chunk_data, output)
+
+@functools.lru_cache(maxsize=None)
+def get_pack_cipher(cc: CountryCode, pack_name: str) -> PackCipher:
+    return PackCipher(cc, pack_name)
+
+def decrypt_pack(chunk_data: Buffer, cc: CountryCode, pack_name: str, output: Optional[memoryview] = None) -> Buffer:
+    """
+    Decrypt one entry of a pack. If `output` is given the entry is decrypted
+    into it (it must be exactly as long as `chunk_data`) and a view of it
+    without the padding is returned.
+    """
+    return get_pack_cipher(cc, pack_name).decrypt(chunk_data, output)
+
+def chunk_hash(chunk: Buffer) -> str:
+    return hashlib.blake2b(chunk, digest_size=16).hexdigest()
+
+def manifest_path(targ_base_path: str) -> str:
+    """e.g. ./data/decrypted/en-15.0/DataLocal.manifest"""
+    return targ_base_path.rstrip('/\\') + '.manifest'
+
+def read_rows(path: str) -> list[list[str]]:
+    if not os.path.exists(path):
+        return []
+    with open(path, encoding='utf-8') as f:
+        return [line.rstrip('\n').split(',') for line in f if line.strip()]
+
+def read_manifest(targ_base_path: str) -> list[list[str]]:
+    """
+    Rows of `name,offset,length,hash,size,content_hash` written by
+    `unpack_pack`, if any: where the entry is in the pack and the hash of its
+    encrypted data, then the size and hash of the decrypted file. Manifests
+    from before the last two were added have only the first four.
+    """
+    return read_rows(manifest_path(targ_base_path))
+
+def write_manifest(targ_base_path: str, rows: list[list[str]]):
+    path = manifest_path(targ_base_path)
+    with open(path + '.tmp', 'w', encoding='utf-8') as f:
+        f.writelines(','.join(row) + '\n' for row in rows)
+    os.replace(path + '.tmp', path)
+    # everything in the journal is in the manifest now
+    with contextlib.suppress(FileNotFoundError):
+        os.remove(journal_path(targ_base_path))
+
+def journal_path(targ_base_path: str) -> str:
+    """e.g. ./data/decrypted/en-15.0/DataLocal.manifest.part"""
+    return manifest_path(targ_base_path) + '.part'
+
+def read_journal(targ_base_path: str) -> list[list[str]]:
+    """Manifest rows of the entries finished so far by a run that didn't finish the pack."""
+    return read_rows(journal_path(targ_base_path))
+
+def open_journal(targ_base_path: str) -> IO[str]:
+    # line buffered, so a row is on disk as soon as its file is
+    return open(journal_path(targ_base_path), 'a', encoding='utf-8', buffering=1)
+
+def complete_rows(rows: list[list[str]]) -> dict[str, list[str]]:
+    """The manifest rows that have a size and content hash, by name."""
+    complete = {}
+    for row in rows:
+        if len(row) == 6 and row[4].isdigit():
+            complete[row[0]] = row
+    return complete
+
+def check_file(path: str, size: int, content_hash: str) -> str:
+    """
+    'ok' if the file at `path` has this size and hash, otherwise 'missing' or
+    'corrupt'. The file is hashed through a mapping, not read into memory.
+    """
+    try:
+        if os.path.getsize(path) != size:
+            return 'corrupt'
+    except FileNotFoundError:
+        return 'missing'
+    with map_file(path) as data:
+        return 'ok' if chunk_hash(data) == content_hash else 'corrupt'
+
+def link_or_copy(src: str, dst: str):
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copyfile(src, dst)
+
+DECRYPTED_DIR = './data/decrypted'
+
+class DirOutput:
+    """A pack's entries as separate files in the folder `path`."""
+
+    def __init__(self, path: str):
+        self.path = path
+
+    def __str__(self) -> str:
+        return self.path
+
+    def prepare(self, resume: bool = False):
+        os.makedirs(self.path, exist_ok=True)
+
+    def write(self, name: str, data: Buffer):
+        path = os.path.join(self.path, name)
+        # the old file may be a hardlink into another version, so it has to be
+        # replaced rather than overwritten
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(path)
+        with open(path, "wb") as f:
+            f.write(data)
+
+    def read(self, name: str) -> Optional[bytes]:
+        path = os.path.join(self.path, name)
+        if not os.path.exists(path):
+            return None
+        return open_file_b(path)
+
+    def reuse(self, previous: "Output", previous_name: str, name: str) -> bool:
+        """Take `name` from `previous_name` in `previous`, if it is there."""
+        if not isinstance(previous, DirOutput):
+            data = previous.read(previous_name)
+            if data is None:
+                return False
+            self.write(name, data)
+            return True
+
+        src = os.path.join(previous.path, previous_name)
+        if not os.path.exists(src):
+            return False
+        dst = os.path.join(self.path, name)
+        if os.path.abspath(src) == os.path.abspath(dst):
+            return True
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(dst)
+        link_or_copy(src, dst)
+        return True
 
-def unpack_pack(list_data: str, pack_data: bytes, base_name: str, cc: CountryCode, targ_base_path: str):
-    files_info = parse_csv_file(None, list_data.split("\n"), 3)
+    def check(self, name: str, size: int, content_hash: str) -> str:
+        """Whether `name` is 'ok', 'missing' or 'corrupt' going by its size and hash."""
+        return check_file(os.path.join(self.path, name), size, content_hash)
 
-    for i, file_info in enumerate(files_info):
-        name = file_info[0]
-        start_offset = int(file_info[1])
-        length = int(file_info[2])
+    def read_manifest(self) -> list[list[str]]:
+        return read_manifest(self.path)
 
-        pk_chunk = pack_data[start_offset : start_offset + length]
-        if "imagedatalocal" in base_name.lower():
-            pk_chunk_decrypted = pk_chunk
+    def write_manifest(self, rows: list[list[str]]):
+        write_manifest(self.path, rows)
+
+    def read_journal(self) -> list[list[str]]:
+        return read_journal(self.path)
+
+    def open_journal(self) -> Optional[IO[str]]:
+        return open_journal(self.path)
+
+    def read_index(self) -> Optional[ListIndex]:
+        return listindex.read_index(self.path)
+
+    def write_index(self, index: ListIndex):
+        listindex.write_index(self.path, index)
+
+class Archive:
+    """
+    Every decrypted pack of a version in a single SQLite file, e.g.
+    ./data/decrypted/en-15.0.sqlite, with entries looked up by (pack, name).
+
+    Everything goes through one connection, so there is one transaction at
+    a time. An `ArchiveOutput` commits its pack with the manifest, which
+    means only one pack can be written at once.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.lock = threading.Lock()
+        # the pack an `ArchiveOutput` is writing, until its manifest is in
+        self.writing: Optional[str] = None
+        import sqlite3
+
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.executescript("""
+            CREATE TABLE IF NOT EXISTS files (
+                pack TEXT NOT NULL,
+                name TEXT NOT NULL,
+                data BLOB NOT NULL,
+                PRIMARY KEY (pack, name)
+            );
+            CREATE TABLE IF NOT EXISTS manifests (
+                pack TEXT PRIMARY KEY,
+                rows TEXT NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS indexes (
+                pack TEXT PRIMARY KEY,
+                data BLOB NOT NULL
+            );
+        """)
+
+    def __enter__(self) -> "Archive":
+        return self
+
+    def __exit__(self, *_):
+        self.close()
+
+    def packs(self) -> list[str]:
+        with self.lock:
+            rows = self.db.execute("SELECT DISTINCT pack FROM files ORDER BY pack").fetchall()
+        return [pack for (pack,) in rows]
+
+    def names(self, pack: str) -> list[str]:
+        with self.lock:
+            rows = self.db.execute("SELECT name FROM files WHERE pack = ? ORDER BY name", (pack,)).fetchall()
+        return [name for (name,) in rows]
+
+    def read(self, pack: str, name: str) -> bytes:
+        with self.lock:
+            row = self.db.execute("SELECT data FROM files WHERE pack = ? AND name = ?", (pack, name)).fetchone()
+        if row is None:
+            raise KeyError((pack, name))
+        return row[0]
+
+    def write(self, pack: str, name: str, data: Buffer):
+        with self.lock:
+            self.db.execute("INSERT OR REPLACE INTO files VALUES (?, ?, ?)", (pack, name, data))
+
+    def close(self):
+        # a pack that didn't get its manifest is dropped, not half committed
+        if self.writing is None:
+            self.db.commit()
         else:
-            pk_chunk_decrypted = decrypt_pack(pk_chunk, cc, base_name)
+            self.db.rollback()
+        self.db.close()
+
+class ArchiveOutput:
+    """A pack's entries written into an `Archive`."""
+
+    def __init__(self, archive: Archive, pack: str):
+        self.archive = archive
+        self.pack = pack
+
+    def __str__(self) -> str:
+        return f"{self.archive.path} ({self.pack})"
+
+    def prepare(self, resume: bool = False):
+        with self.archive.lock:
+            if self.archive.writing is not None:
+                raise ValueError(f'{self.archive.path}: {self.archive.writing} is still being written, packs have to go in one at a time')
+            self.archive.writing = self.pack
+            if not resume:
+                self.archive.db.execute("DELETE FROM files WHERE pack = ?", (self.pack,))
+
+    def write(self, name: str, data: Buffer):
+        self.archive.write(self.pack, name, data)
+
+    def read(self, name: str) -> Optional[bytes]:
+        try:
+            return self.archive.read(self.pack, name)
+        except KeyError:
+            return None
+
+    def reuse(self, previous: "Output", previous_name: str, name: str) -> bool:
+        data = previous.read(previous_name)
+        if data is None:
+            return False
+        self.write(name, data)
+        return True
 
-        open(os.path.join(targ_base_path, name), "wb").write(pk_chunk_decrypted)
+    def check(self, name: str, size: int, content_hash: str) -> str:
+        data = self.read(name)
+        if data is None:
+            return 'missing'
+        return 'ok' if len(data) == size and chunk_hash(data) == content_hash else 'corrupt'
 
-        j = i + 1
-        progress(j / len(files_info), j, len(files_info), False)
+    def read_manifest(self) -> list[list[str]]:
+        with self.archive.lock:
+            row = self.archive.db.execute("SELECT rows FROM manifests WHERE pack = ?", (self.pack,)).fetchone()
+        if row is None:
+            return []
+        return [line.split(',') for line in row[0].splitlines()]
 
-    print()
+    def write_manifest(self, rows: list[list[str]]):
+        # the manifest goes in last, so a pack is committed once it is complete
+        names = {row[0] for row in rows}
+        with self.archive.lock:
+            # files kept from an earlier run that the pack no longer has
+            stale = [
+                (self.pack, name)
+                for (name,) in self.archive.db.execute("SELECT name FROM files WHERE pack = ?", (self.pack,))
+                if name not in names
+            ]
+            self.archive.db.executemany("DELETE FROM files WHERE pack = ? AND name = ?", stale)
+            self.archive.db.execute(
+                "INSERT OR REPLACE INTO manifests VALUES (?, ?)",
+                (self.pack, ''.join(','.join(row) + '\n' for row in rows)),
+            )
+            self.archive.db.commit()
+            self.archive.writing = None
 
-def decryptfile(list_data: bytes, pack_data: bytes, base_name: str, cc: CountryCode, targ_base_path: str):
+    def read_journal(self) -> list[list[str]]:
+        # a pack's rows are only committed with its manifest
+        return []
+
+    def open_journal(self) -> Optional[IO[str]]:
+        return None
+
+    def read_index(self) -> Optional[ListIndex]:
+        with self.archive.lock:
+            row = self.archive.db.execute("SELECT data FROM indexes WHERE pack = ?", (self.pack,)).fetchone()
+        if row is None:
+            return None
+        return ListIndex.from_bytes(row[0])
+
+    def write_index(self, index: ListIndex):
+        with self.archive.lock:
+            self.archive.db.execute("INSERT OR REPLACE INTO indexes VALUES (?, ?)", (self.pack, index.to_bytes()))
+
+STORE_DIR = './data/store'
+
+class Store:
+    """
+    Decrypted files of any number of versions with every distinct file kept
+    once, e.g. in ./data/store. `objects/ab/cdef...` is a blob named by the
+    hash of its content and `versions/<version>/<pack>.objects` says which
+    blob each file of that pack is, next to the pack's manifest and index.
+    """
+
+    def __init__(self, path: str = STORE_DIR):
+        self.path = path
+
+    def blob_path(self, content_hash: str) -> str:
+        return os.path.join(self.path, 'objects', content_hash[:2], content_hash[2:])
+
+    def version_path(self, version: str) -> str:
+        return os.path.join(self.path, 'versions', version)
+
+    def put(self, data: Buffer) -> str:
+        """Add `data` if it isn't there yet and return its hash."""
+        content_hash = chunk_hash(data)
+        path = self.blob_path(content_hash)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp = f'{path}.{os.getpid()}-{threading.get_ident()}.tmp'
+            with open(tmp, 'wb') as f:
+                f.write(data)
+            os.replace(tmp, path)
+        return content_hash
+
+    def get(self, content_hash: str) -> bytes:
+        return open_file_b(self.blob_path(content_hash))
+
+    def versions(self) -> list[str]:
+        path = os.path.join(self.path, 'versions')
+        return sorted(os.listdir(path)) if os.path.isdir(path) else []
+
+    def packs(self, version: str) -> list[str]:
+        path = self.version_path(version)
+        if not os.path.isdir(path):
+            return []
+        return sorted(name[: -len('.objects')] for name in os.listdir(path) if name.endswith('.objects'))
+
+    def objects(self, version: str, pack: str) -> dict[str, str]:
+        """Which blob each file of `pack` in `version` is, by name."""
+        path = os.path.join(self.version_path(version), pack + '.objects')
+        if not os.path.exists(path):
+            return {}
+        with open(path, encoding='utf-8') as f:
+            return dict(line.rstrip('\n').split(',') for line in f if line.strip())  # type: ignore
+
+    def materialize(self, version: str, dest: str) -> int:
+        """
+        Lay `version` out in `dest` like a normal decrypt would, e.g. in
+        ./data/decrypted/en-15.0, with every file hardlinked (or copied) from
+        its blob. Returns how many files there are. Don't edit files in `dest`
+        in place, since with hardlinks that edits the blob as well.
+        """
+        count = 0
+        for pack in self.packs(version):
+            pack_dest = os.path.join(dest, pack)
+            os.makedirs(pack_dest, exist_ok=True)
+            for name, content_hash in self.objects(version, pack).items():
+                path = os.path.join(pack_dest, name)
+                with contextlib.suppress(FileNotFoundError):
+                    os.remove(path)
+                link_or_copy(self.blob_path(content_hash), path)
+                count += 1
+            for suffix in ('.manifest', '.index'):
+                src = os.path.join(self.version_path(version), pack + suffix)
+                if os.path.exists(src):
+                    shutil.copyfile(src, pack_dest + suffix)
+        return count
+
+    def gc(self) -> tuple[int, int]:
+        """
+        Delete every blob that no version refers to, and anything left over
+        from an interrupted write. Returns how many files and bytes were
+        removed. Not safe to run while something is being decrypted into the
+        store.
+        """
+        referenced = set()
+        for version in self.versions():
+            for pack in self.packs(version):
+                referenced.update(self.objects(version, pack).values())
+
+        removed = size = 0
+        objects = os.path.join(self.path, 'objects')
+        if not os.path.isdir(objects):
+            return removed, size
+        for prefix in os.listdir(objects):
+            folder = os.path.join(objects, prefix)
+            for name in os.listdir(folder):
+                if prefix + name not in referenced:
+                    path = os.path.join(folder, name)
+                    size += os.path.getsize(path)
+                    os.remove(path)
+                    removed += 1
+            if not os.listdir(folder):
+                os.rmdir(folder)
+        return removed, size
+
+class StoreOutput:
+    """A pack's entries written into a `Store` as part of `version`."""
+
+    def __init__(self, store: Store, version: str, pack: str):
+        self.store = store
+        self.version = version
+        self.pack = pack
+        self.path = os.path.join(store.version_path(version), pack)
+        self.lock = threading.Lock()
+        self.objects: Optional[dict[str, str]] = None
+
+    def __str__(self) -> str:
+        return f"{self.store.path} ({self.version}/{self.pack})"
+
+    def blobs(self) -> dict[str, str]:
+        if self.objects is None:
+            self.objects = self.store.objects(self.version, self.pack)
+        return self.objects
+
+    def prepare(self, resume: bool = False):
+        os.makedirs(self.store.version_path(self.version), exist_ok=True)
+        self.objects = {}
+
+    def write(self, name: str, data: Buffer):
+        content_hash = self.store.put(data)
+        with self.lock:
+            self.blobs()[name] = content_hash
+
+    def read(self, name: str) -> Optional[bytes]:
+        content_hash = self.blobs().get(name)
+        if content_hash is None:
+            return None
+        return self.store.get(content_hash)
+
+    def reuse(self, previous: "Output", previous_name: str, name: str) -> bool:
+        if isinstance(previous, StoreOutput) and previous.store.path == self.store.path:
+            content_hash = previous.blobs().get(previous_name)
+            if content_hash is None or not os.path.exists(self.store.blob_path(content_hash)):
+                return False
+            with self.lock:
+                self.blobs()[name] = content_hash
+            return True
+
+        data = previous.read(previous_name)
+        if data is None:
+            return False
+        self.write(name, data)
+        return True
+
+    def check(self, name: str, size: int, content_hash: str) -> str:
+        """
+        Like `DirOutput.check`, for the blob `content_hash`. If it is 'ok'
+        it becomes `name` again, so a resumed pack keeps it. A corrupt blob
+        is deleted, since `Store.put` doesn't replace blobs that exist.
+        """
+        path = self.store.blob_path(content_hash)
+        result = check_file(path, size, content_hash)
+        if result == 'ok':
+            with self.lock:
+                self.blobs()[name] = content_hash
+        elif result == 'corrupt':
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(path)
+        return result
+
+    def read_manifest(self) -> list[list[str]]:
+        return read_manifest(self.path)
+
+    def read_journal(self) -> list[list[str]]:
+        return read_journal(self.path)
+
+    def open_journal(self) -> Optional[IO[str]]:
+        return open_journal(self.path)
+
+    def write_manifest(self, rows: list[list[str]]):
+        # the manifest goes in last, so a pack is complete once it is there
+        with open(self.path + '.objects.tmp', 'w', encoding='utf-8') as f:
+            f.writelines(f'{name},{content_hash}\n' for name, content_hash in sorted(self.blobs().items()))
+        os.replace(self.path + '.objects.tmp', self.path + '.objects')
+        write_manifest(self.path, rows)
+
+    def read_index(self) -> Optional[ListIndex]:
+        return listindex.read_index(self.path)
+
+    def write_index(self, index: ListIndex):
+        listindex.write_index(self.path, index)
+
+Output = Union[DirOutput, ArchiveOutput, StoreOutput]
+
+class VersionOutput:
+    """
+    Where the packs of `version` get decrypted to: a folder per pack in
+    ./data/decrypted/<version>, ./data/decrypted/<version>.sqlite if
+    `archive` is set, or `store` if there is one.
+    """
+
+    def __init__(
+        self, version: str, archive: bool = False, base_dir: str = DECRYPTED_DIR, store: Optional[Store] = None
+    ):
+        self.version = version
+        self.path = os.path.join(base_dir, version)
+        self.store = store
+        self.archive = None
+        if archive and store is None:
+            os.makedirs(base_dir, exist_ok=True)
+            self.archive = Archive(self.path + '.sqlite')
+
+    @staticmethod
+    def find(version: str, base_dir: str = DECRYPTED_DIR, store_dir: str = STORE_DIR) -> "VersionOutput":
+        """An existing version, in whichever form it was decrypted."""
+        if os.path.isdir(os.path.join(base_dir, version)):
+            return VersionOutput(version, False, base_dir)
+        if os.path.exists(os.path.join(base_dir, version + '.sqlite')):
+            return VersionOutput(version, True, base_dir)
+        store = Store(store_dir)
+        if os.path.isdir(store.version_path(version)):
+            return VersionOutput(version, False, base_dir, store)
+        return VersionOutput(version, False, base_dir)
+
+    @staticmethod
+    def open(
+        version: str, archive: bool = False, store: Optional[Store] = None, base_dir: str = DECRYPTED_DIR
+    ) -> "VersionOutput":
+        """
+        An existing version in the form `archive` or `store` ask for, or in
+        whichever form `find` finds it if neither is given.
+        """
+        if archive or store is not None:
+            return VersionOutput(version, archive, base_dir, store)
+        return VersionOutput.find(version, base_dir)
+
+    def pack(self, name: str) -> Output:
+        if self.store is not None:
+            return StoreOutput(self.store, self.version, name)
+        if self.archive is not None:
+            return ArchiveOutput(self.archive, name)
+        return DirOutput(os.path.join(self.path, name))
+
+    def close(self):
+        if self.archive is not None:
+            self.archive.close()
+
+def unpack_pack(
+    list_data: str,
+    pack_data: Buffer,
+    base_name: str,
+    cc: CountryCode,
+    targ_base_path: str,
+    jobs: int = 1,
+    previous: Union[str, Output, None] = None,
+    output: Optional[Output] = None,
+    log: Callable[[str], None] = print,
+    resume: bool = True,
+):
+    """
+    Decrypt every file listed in `list_data` to `output`, by default the
+    folder `targ_base_path`. With `jobs`
+    > 1 the list is split into that many runs of consecutive files which are
+    decrypted on separate threads (pycryptodome releases the GIL).
+
+    `pack_data` is only ever sliced through a memoryview and each thread
+    decrypts into one reused buffer, so passing a `map_file` mapping keeps
+    memory use flat however big the pack is.
+
+    The list is parsed into a `ListIndex` and checked against the size of
+    the pack before anything is written, then saved with the output so the
+    entries can be looked up later without decrypting the list again.
+
+    A manifest with the hash of every encrypted entry and the size and hash
+    of every decrypted file is saved with the output. If `previous` is the
+    same pack decrypted from another version, entries whose hash is in its
+    manifest are hardlinked (or copied) from there instead of being
+    decrypted again.
+
+    Rows are also added to a journal as entries are written, so if a run
+    stops partway the entries it finished are known. With `resume`, entries
+    that the output's manifest or journal has for the same encrypted data
+    are kept as they are if their size and hash still match.
+    """
+    pack_view = memoryview(pack_data)
+    index = ListIndex.parse(list_data)
+    try:
+        index.validate(len(pack_view))
+    except ValueError as e:
+        pack_view.release()
+        raise ValueError(f'{base_name}: {e}') from None
+    names, offsets, lengths = index.names, index.offsets, index.lengths
+
+    cipher = get_pack_cipher(cc, base_name)
+    if output is None:
+        output = DirOutput(targ_base_path)
+    output.write_index(index)
+    if isinstance(previous, str):
+        previous = DirOutput(previous)
+
+    reusable: dict[str, list[str]] = {}
+    if previous is not None:
+        reusable = {row[3]: row for row in previous.read_manifest()}
+    done: dict[str, list[str]] = {}
+    if resume:
+        done = complete_rows(output.read_manifest() + output.read_journal())
+    rows: list[list[str]] = [[]] * len(index)
+    reused = kept = 0
+
+    lock = threading.Lock()
+    journal = output.open_journal()
+    pack_span = metrics.span('pack decrypt', base_name, total_count=len(index))
+    write_span = metrics.span('write', base_name)
+    def unpack_files(run: range):
+        try:
+            unpack_run(run)
+        except BaseException as e:
+            # slices of the pack left in the traceback would stop a mapping
+            # from being closed, hiding this error behind a BufferError
+            traceback.clear_frames(e.__traceback__)
+            raise
+
+    def unpack_run(run: range):
+        nonlocal reused, kept
+        buffer = bytearray()
+        for i in run:
+            name = names[i]
+            start_offset = offsets[i]
+            length = lengths[i]
+
+            pk_chunk = pack_view[start_offset : start_offset + length]
+            pk_hash = chunk_hash(pk_chunk)
+            entry = [name, str(start_offset), str(length), pk_hash]
+
+            row = done.get(name)
+            if row is not None and row[3] == pk_hash and output.check(name, int(row[4]), row[5]) == 'ok':  # type: ignore
+                rows[i] = entry + row[4:]
+                with lock:
+                    kept += 1
+                pack_span.add(bytes=length, count=1)
+                continue
+
+            row = reusable.get(pk_hash)
+            if row is not None and not output.reuse(previous, row[0], name):  # type: ignore
+                row = None
+            if row is not None and len(row) < 6:
+                # the previous manifest is from before sizes were added, so they
+                # come from the copy, and if that can't be read it is decrypted
+                data = output.read(name)  # type: ignore
+                row = row[:4] + [str(len(data)), chunk_hash(data)] if data is not None else None
+            if row is not None:
+                rows[i] = entry + row[4:]
+                with lock:
+                    reused += 1
+                    if journal is not None:
+                        journal.write(','.join(rows[i]) + '\n')
+                pack_span.add(bytes=length, count=1)
+                continue
+
+            if cipher.passthrough:
+                pk_chunk_decrypted = pk_chunk
+            else:
+                if len(buffer) < length:
+                    buffer = bytearray(length)
+                pk_chunk_decrypted = cipher.decrypt(pk_chunk, memoryview(buffer)[:length])
+            content_hash = pk_hash if cipher.passthrough else chunk_hash(pk_chunk_decrypted)
+
+            start = time.perf_counter()
+            output.write(name, pk_chunk_decrypted)  # type: ignore
+            write_span.add(bytes=len(pk_chunk_decrypted), count=1, busy=time.perf_counter() - start)
+            rows[i] = entry + [str(len(pk_chunk_decrypted)), content_hash]
+            if journal is not None:
+                with lock:
+                    journal.write(','.join(rows[i]) + '\n')
+            pack_span.add(bytes=length, count=1)
+
+    with contextlib.ExitStack() as stack:
+        if journal is not None:
+            stack.enter_context(journal)
+        with pack_view, pack_span, write_span:
+            if jobs <= 1:
+                unpack_files(range(len(index)))
+            else:
+                from concurrent.futures import ThreadPoolExecutor
+
+                size = -(-len(index) // jobs)
+                runs = [range(i, min(i + size, len(index))) for i in range(0, len(index), size)]
+                with ThreadPoolExecutor(jobs) as executor:
+                    list(executor.map(unpack_files, runs))
+
+    if previous is not None:
+        log(f'reused {reused}/{len(index)} files from {previous}')
+    if kept:
+        log(f'kept {kept}/{len(index)} files that were already decrypted')
+
+    output.write_manifest(rows)
+
+def version_cc(version: str) -> CountryCode:
+    """e.g. en-15.0 -> CountryCode.EN"""
+    [lang, *_] = os.path.basename(version.rstrip('/\\')).partition('-')
+    return CountryCode.from_cc(lang)
+
+class PackReader:
+    """
+    Random access to the files of one .list/.pack pair. The list is parsed
+    once into an index and entries are only decrypted when read, with the
+    most recently read ones kept in memory up to `cache_size` bytes.
+    """
+
+    def __init__(
+        self,
+        list_data: bytes,
+        pack_data: Buffer,
+        base_name: str,
+        cc: CountryCode,
+        cache_size: int = 16 * 1024 * 1024,
+    ):
+        self.base_name = base_name
+        self.cc = cc
+        self.cipher = get_pack_cipher(cc, base_name)
+        self.pack_data = pack_data
+        self.index = ListIndex.parse(unpack_list(list_data).decode("utf-8"))
+        self.index.validate(len(pack_data))
+
+        self.cache_size = cache_size
+        self.cache: OrderedDict[str, bytes] = OrderedDict()
+        self.cached = 0
+        self.lock = threading.Lock()
+        self.stack = contextlib.ExitStack()
+
+    @staticmethod
+    def open(
+        source: str, base_name: str, cc: Optional[CountryCode] = None, cache_size: int = 16 * 1024 * 1024
+    ) -> "PackReader":
+        """
+        Open `base_name` (e.g. DataLocal) from `source`, which is either an
+        extracted folder such as ./data/extracted/en-15.0 or an apk such as
+        en-15.0.apk. `cc` defaults to the one in the name of `source`.
+        """
+        if cc is None:
+            cc = version_cc(os.path.splitext(source)[0] if source.endswith('.apk') else source)
+
+        stack = contextlib.ExitStack()
+        try:
+            if os.path.isdir(source):
+                list_data = open_file_b(os.path.join(source, 'assets', f'{base_name}.list'))
+                pack_data = stack.enter_context(map_file(os.path.join(source, 'assets', f'{base_name}.pack')))
+            else:
+                apk = stack.enter_context(open_inner_apk(source))
+                list_data = apk.zip.read(f'assets/{base_name}.list')
+                pack_data = stack.enter_context(apk.member(apk.zip.getinfo(f'assets/{base_name}.pack')))
+            reader = PackReader(list_data, pack_data, base_name, cc, cache_size)
+        except BaseException:
+            stack.close()
+            raise
+        reader.stack = stack
+        return reader
+
+    def __enter__(self) -> "PackReader":
+        return self
+
+    def __exit__(self, *_):
+        self.close()
+
+    def close(self):
+        self.cache.clear()
+        self.stack.close()
+
+    def names(self) -> list[str]:
+        return list(self.index.names)
+
+    def __contains__(self, name: str) -> bool:
+        return name in self.index
+
+    def encrypted_hash(self, name: str) -> str:
+        """The `chunk_hash` of `name` as it is in the pack, like in a manifest."""
+        start_offset, length = self.index.find(name)
+        with memoryview(self.pack_data) as pack_view:
+            pk_chunk = pack_view[start_offset : start_offset + length]
+            content_hash = chunk_hash(pk_chunk)
+            pk_chunk.release()
+        return content_hash
+
+    def read(self, name: str) -> bytes:
+        with self.lock:
+            if name in self.cache:
+                self.cache.move_to_end(name)
+                return self.cache[name]
+
+        start_offset, length = self.index.find(name)
+        with memoryview(self.pack_data) as pack_view:
+            pk_chunk = pack_view[start_offset : start_offset + length]
+            data = bytes(self.cipher.unpack(pk_chunk))
+            pk_chunk.release()
+
+        if len(data) <= self.cache_size:
+            with self.lock:
+                if name not in self.cache:
+                    self.cache[name] = data
+                    self.cached += len(data)
+                while self.cached > self.cache_size:
+                    _, old = self.cache.popitem(last=False)
+                    self.cached -= len(old)
+        return data
+
+def decryptfile(
+    list_data: bytes,
+    pack_data: Buffer,
+    base_name: str,
+    cc: CountryCode,
+    targ_base_path: str,
+    jobs: int = 1,
+    previous: Union[str, Output, None] = None,
+    output: Optional[Output] = None,
+    log: Callable[[str], None] = print,
+    resume: bool = True,
+):
     """
     - list_data: content of the .list file
-    - pack_data: content of the .pack file
+    - pack_data: content of the .pack file, as bytes or from `map_file`
     - base_name: e.g. DataLocal
     - cc: lang
     - targ_base_path: e.g. ./data/decrypted/en-15.0/DataLocal
+    - jobs: number of threads to decrypt with
+    - previous: the same pack decrypted from an older version, e.g.
+      ./data/decrypted/en-14.7/DataLocal, to reuse unchanged files from
+    - output: where to write to instead of the folder `targ_base_path`
+    - log: what messages are printed with
+    - resume: keep files that an earlier run already decrypted intact
     """
-    list_data_str = unpack_list(list_data).decode("utf-8")
+    with metrics.span('list decrypt', base_name) as span:
+        list_data_str = unpack_list(list_data).decode("utf-8")
+        span.add(bytes=len(list_data), count=1)
     if list_data_str == '0\n':
-        print(f'skipping {base_name}')
+        log(f'skipping {base_name}')
+        return
+
+    if output is None:
+        output = DirOutput(targ_base_path)
+    log(f"extracting to {output}")
+    output.prepare(resume)
+
+    unpack_pack(list_data_str, pack_data, base_name, cc, targ_base_path, jobs, previous, output, log, resume)
+
+class PackCheck(NamedTuple):
+    """How many files of a pack are intact, and which are missing or corrupt."""
+
+    ok: int
+    missing: list[str]
+    corrupt: list[str]
+
+def verify_pack(list_data: bytes, output: Output, jobs: int = 1) -> PackCheck:
+    """
+    Check the decrypted files of a pack against its .list and the manifest
+    and journal in `output`, `jobs` files at a time. A file is missing if
+    they don't have it at the place the list says, and corrupt if its size
+    or hash doesn't match.
+    """
+    from concurrent.futures import ThreadPoolExecutor
+
+    index = ListIndex.parse(unpack_list(list_data).decode("utf-8"))
+    rows = complete_rows(output.read_manifest() + output.read_journal())
+
+    def check(entry: tuple[str, int, int]) -> str:
+        name, offset, length = entry
+        row = rows.get(name)
+        if row is None or row[1:3] != [str(offset), str(length)]:
+            return 'missing'
+        return output.check(name, int(row[4]), row[5])  # type: ignore
+
+    with ThreadPoolExecutor(jobs) as executor:
+        results = list(executor.map(check, index))
+    return PackCheck(
+        results.count('ok'),
+        [name for name, result in zip(index.names, results) if result == 'missing'],
+        [name for name, result in zip(index.names, results) if result == 'corrupt'],
+    )
+
+def verify_packs(lists: dict[str, bytes], version_output: VersionOutput, jobs: int = 1) -> bool:
+    """Print `verify_pack` for every pack in `lists`, by name. Returns whether they are all intact."""
+    missing = corrupt = 0
+    for name, list_data in lists.items():
+        with metrics.span('verify', name):
+            check = verify_pack(list_data, version_output.pack(name), jobs)
+        if not (check.ok or check.missing or check.corrupt):
+            continue
+        line = f'{name}: {check.ok} ok'
+        if check.missing:
+            line += f', {len(check.missing)} missing'
+        if check.corrupt:
+            line += f', {len(check.corrupt)} corrupt'
+        print(line)
+        for file in check.missing:
+            print(f'  missing: {file}')
+        for file in check.corrupt:
+            print(f'  corrupt: {file}')
+        missing += len(check.missing)
+        corrupt += len(check.corrupt)
+
+    if missing or corrupt:
+        print(f'{missing} missing and {corrupt} corrupt files, decrypt again to redo only those')
+    else:
+        print('Everything is intact')
+    return not (missing or corrupt)
+
+PACK_MEMORY_BUDGET = 1024 * 1024 * 1024
+
+class PackJob(NamedTuple):
+    """
+    A pack to decrypt: `open` gives `(list_data, pack_data)` for as long as
+    its context is entered, `size` is roughly how much memory that takes.
+    """
+
+    name: str
+    size: int
+    open: Callable[[], ContextManager[tuple[bytes, Buffer]]]
+
+
+def dir_pack_jobs(assets_dir: str, names: list[str]) -> list[PackJob]:
+    """Jobs for the packs `names` in an extracted assets folder."""
+
+    def opener(name: str) -> Callable[[], ContextManager[tuple[bytes, Buffer]]]:
+        @contextlib.contextmanager
+        def open_pack() -> Iterator[tuple[bytes, Buffer]]:
+            list_data = open_file_b(os.path.join(assets_dir, f'{name}.list'))
+            with map_file(os.path.join(assets_dir, f'{name}.pack')) as pack_data:
+                yield list_data, pack_data
+
+        return open_pack
+
+    return [
+        PackJob(name, os.path.getsize(os.path.join(assets_dir, f'{name}.pack')), opener(name))
+        for name in names
+    ]
+
+
+def decrypt_packs(
+    pack_jobs: list[PackJob],
+    cc: CountryCode,
+    version_output: VersionOutput,
+    previous_output: Optional[VersionOutput] = None,
+    workers: int = 1,
+    jobs: int = 1,
+    memory_budget: int = PACK_MEMORY_BUDGET,
+    resume: bool = True,
+):
+    """
+    Decrypt every pack in `pack_jobs` to `version_output`, `jobs` threads
+    per pack and `workers` packs at a time, keeping files from an earlier run
+    that are still intact if `resume` is set.
+
+    With `workers` > 1 the biggest packs start first so a big pack doesn't
+    end up running on its own at the end. Packs are opened one at a time on
+    this thread, so the next pack is read while the others are decrypted,
+    and only as long as the packs that are open fit in `memory_budget` (a
+    pack bigger than the whole budget waits until nothing else is open).
+    Messages are held back and printed in the order of `pack_jobs`, so the
+    output doesn't depend on which pack finishes first. An archive takes one
+    pack at a time, so `workers` is 1 for one.
+    """
+    if version_output.archive is not None:
+        workers = 1
+
+    def decrypt(job: PackJob, list_data: bytes, pack_data: Buffer, log: Callable[[str], None]):
+        targ_base_path = os.path.join(version_output.path, job.name)
+        output = version_output.pack(job.name)
+        previous = previous_output.pack(job.name) if previous_output is not None else None
+        decryptfile(list_data, pack_data, job.name, cc, targ_base_path, jobs, previous, output, log, resume)
+
+    if workers <= 1:
+        for job in pack_jobs:
+            with job.open() as (list_data, pack_data):
+                decrypt(job, list_data, pack_data, print)
         return
 
-    print("extracting to", targ_base_path)
-    os.makedirs(targ_base_path, exist_ok=True)
+    logs: list[list[str]] = [[] for _ in pack_jobs]
+    done = [False] * len(pack_jobs)
+    printed = 0
+    print_lock = threading.Lock()
+    budget = threading.Condition()
+    in_use = 0
+
+    def run(i: int, stack: contextlib.ExitStack, cost: int, list_data: bytes, pack_data: Buffer):
+        nonlocal in_use, printed
+        job = pack_jobs[i]
+        start = time.perf_counter()
+        try:
+            with stack:
+                decrypt(job, list_data, pack_data, logs[i].append)
+            took = time.perf_counter() - start
+            logs[i].append(f'{job.name}: {metrics.FileSize(job.size)} in {took:.2f}s')
+        finally:
+            with budget:
+                in_use -= cost
+                budget.notify_all()
+            with print_lock:
+                done[i] = True
+                while printed < len(pack_jobs) and done[printed]:
+                    for line in logs[printed]:
+                        print(line)
+                    printed += 1
+
+    order = sorted(range(len(pack_jobs)), key=lambda i: pack_jobs[i].size, reverse=True)
 
-    unpack_pack(list_data_str, pack_data, base_name, cc, targ_base_path)
+    # concurrent progress bars would just overwrite each other, and summary
+    # lines would come out in whatever order the packs finish
+    sink = metrics.sink
+    if isinstance(sink, metrics.BarSink):
+        metrics.sink = metrics.QuietSink()
+    from concurrent.futures import ThreadPoolExecutor
+
+    start = time.perf_counter()
+    try:
+        with ThreadPoolExecutor(workers) as executor:
+            futures = []
+            for i in order:
+                cost = pack_jobs[i].size
+                with budget:
+                    budget.wait_for(lambda: in_use == 0 or in_use + cost <= memory_budget)
+                    in_use += cost
+                stack = contextlib.ExitStack()
+                try:
+                    list_data, pack_data = stack.enter_context(pack_jobs[i].open())
+                except BaseException:
+                    stack.close()
+                    with budget:
+                        in_use -= cost
+                    raise
+                futures.append(executor.submit(run, i, stack, cost, list_data, pack_data))
+            for future in futures:
+                future.result()
+    finally:
+        metrics.sink = sink
+    elapsed = time.perf_counter() - start
+
+    total = sum(job.size for job in pack_jobs)
+    print(
+        f'Decrypted {len(pack_jobs)} packs, {metrics.FileSize(total)} in {elapsed:.1f}s '
+        f'({metrics.FileSize(int(total / max(elapsed, 1e-6)))}/s)'
+    )
 
 if __name__ == '__main__':
-    container = sys.argv[1].rstrip('/\\')
+    args = sys.argv[1:]
+    metrics.configure(pop_option(args, '--metrics'))
+    jobs = int(pop_option(args, '--jobs', '1'))  # type: ignore
+    packs = int(pop_option(args, '--packs', '1'))  # type: ignore
+    memory_budget = int(pop_option(args, '--memory-budget', str(PACK_MEMORY_BUDGET >> 20))) << 20  # type: ignore
+    previous = pop_option(args, '--previous')
+    archive = '--archive' in args
+    if archive:
+        args.remove('--archive')
+    store = Store() if '--store' in args else None
+    if store is not None:
+        args.remove('--store')
+    verify = '--verify' in args
+    if verify:
+        args.remove('--verify')
+    resume = '--force' not in args
+    if not resume:
+        args.remove('--force')
+    container = args[0].rstrip('/\\')
     names = []
     for fname in os.listdir(os.path.join(container, 'assets')):
         name, ext = os.path.splitext(fname)
@@ -170,16 +1235,21 @@ if __name__ == '__main__':
     names.sort()
 
     extracted_name = os.path.basename(container)
-    [lang, *_] = extracted_name.partition('-')
-    cc = CountryCode.from_cc(lang)
+    cc = version_cc(extracted_name)
 
-    for name in names:
-        list_file = os.path.join(container, 'assets', f'{name}.list')
-        list_data = open_file_b(list_file)
+    if verify:
+        version_output = VersionOutput.open(extracted_name, archive, store)
+        lists = {name: open_file_b(os.path.join(container, 'assets', f'{name}.list')) for name in names}
+        intact = verify_packs(lists, version_output, jobs)
+        version_output.close()
+        sys.exit(0 if intact else 1)
 
-        pack_file = os.path.join(container, 'assets', f'{name}.pack')
-        pack_data = open_file_b(pack_file)
+    version_output = VersionOutput(extracted_name, archive, store=store)
+    previous_output = VersionOutput.find(previous) if previous is not None else None
 
-        targ_base_path = os.path.join('./data/decrypted', extracted_name, name)
+    pack_jobs = dir_pack_jobs(os.path.join(container, 'assets'), names)
+    decrypt_packs(pack_jobs, cc, version_output, previous_output, packs, jobs, memory_budget, resume)
 
-        decryptfile(list_data, pack_data, name, cc, targ_base_path)
+    version_output.close()
+    if previous_output is not None:
+        previous_output.close()
@@ -0,0 +1,66 @@
+"""Show what changed between two versions without decrypting them"""
+
+import difflib
+import os
+import sys
+import metrics
+from core import pop_option
+from versionfs import VersionFS, diff_versions
+
+USAGE = """Usage: python diff.py <old> <new> [--content] [--jobs <n>]
+  <old> and <new> are versions such as en-14.7, or paths to apks or extracted folders
+  --content also prints how each modified file changed"""
+
+args = sys.argv[1:]
+metrics.configure(pop_option(args, '--metrics'))
+jobs = int(pop_option(args, '--jobs', '1'))  # type: ignore
+content = '--content' in args
+if content:
+    args.remove('--content')
+if len(args) < 2:
+    print(USAGE)
+    sys.exit(1)
+
+
+def open_version(source: str) -> VersionFS:
+    source = os.path.expanduser(source)
+    if os.path.exists(source):
+        return VersionFS(source)
+    return VersionFS.find(source)
+
+
+def content_diff(old: bytes, new: bytes, path: str) -> list[str]:
+    try:
+        old_text, new_text = old.decode('utf-8'), new.decode('utf-8')
+    except UnicodeDecodeError:
+        return [f'binary files differ, {len(old)} -> {len(new)} bytes\n']
+    return list(
+        difflib.unified_diff(
+            old_text.splitlines(keepends=True),
+            new_text.splitlines(keepends=True),
+            f'a/{path}',
+            f'b/{path}',
+        )
+    )
+
+
+with open_version(args[0]) as old, open_version(args[1]) as new:
+    diffs = diff_versions(old, new, jobs)
+    totals = [0, 0, 0]
+    for pack, diff in diffs.items():
+        if not diff:
+            continue
+        print(f'{pack}: {len(diff.added)} added, {len(diff.removed)} removed, {len(diff.modified)} modified')
+        for name in diff.added:
+            print(f'  + {name}')
+        for name in diff.removed:
+            print(f'  - {name}')
+        for name in diff.modified:
+            print(f'  M {name}')
+            if content:
+                lines = content_diff(old.reader(pack).read(name), new.reader(pack).read(name), f'{pack}/{name}')
+                sys.stdout.writelines(line if line.endswith('\n') else line + '\n' for line in lines)
+        totals = [total + len(names) for total, names in zip(totals, diff)]
+
+    changed = sum(1 for diff in diffs.values() if diff)
+    print(f'{totals[0]} added, {totals[1]} removed, {totals[2]} modified in {changed}/{len(diffs)} packs')
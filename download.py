@@ -1,84 +1,32 @@
 from __future__ import annotations
 
-import enum
-from typing import Literal, Any, TypedDict
-import requests
+import functools
+import hashlib
+from typing import Any, BinaryIO, Callable, Generic, Iterable, Iterator, TypedDict, TypeVar
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
+import bisect
+import glob
 import os
+import shutil
+import threading
 import sys
-import re
+import json
+import time
 import traceback
+import urllib.parse
+import asynchttp
+import htmlscan
+import metrics
+from asynchttp import AsyncClient
+from core import CountryCode, pop_option
+from metrics import FileSize
 
 ################################################################################
 # Most code in this file is taken from tbcml, in particular src/tbcml/io/apk.py
 ################################################################################
 
 
-# https://codeberg.org/fieryhenry/tbcml/src/branch/master/src/tbcml/io/file_handler.py
-class FileSize:
-    def __init__(self, file_size: int):
-        self.file_size = file_size
-
-    def __str__(self) -> str:
-        return self.format()
-
-    def __repr__(self) -> str:
-        return self.format()
-
-    def format(self) -> str:
-        if self.file_size < 1024:
-            return f"{self.file_size} B"
-        elif self.file_size < 1024**2:
-            return f"{self.file_size / 1024:.2f} KiB"
-        elif self.file_size < 1024**3:
-            return f"{self.file_size / 1024 ** 2:.2f} MiB"
-        elif self.file_size < 1024**4:
-            return f"{self.file_size / 1024 ** 3:.2f} GiB"
-        else:
-            return f"{self.file_size / 1024 ** 4:.2f} TiB"
-
-
-# https://codeberg.org/fieryhenry/tbcml/src/branch/master/src/tbcml/country_code.py
-class CountryCode(enum.Enum):
-    """Country code enum."""
-
-    EN = "en"
-    JP = "jp"
-    KR = "kr"
-    TW = "tw"
-
-    @staticmethod
-    def from_cc(cc: str | Literal["en"] | Literal["jp"] | Literal["kr"] | Literal["tw"] | CountryCode):
-        if isinstance(cc, str):
-            return CountryCode.from_code(cc)
-        return cc
-
-    @staticmethod
-    def from_code(code: str) -> CountryCode:
-        map = {
-            "ja": "jp",
-            "ko": "kr",
-        }
-        # alternative names for these codes
-        codel = code.lower()
-        if codel in map:
-            codel = map[codel]
-        for country_code in CountryCode:
-            if country_code.value == codel:
-                return country_code
-
-        raise ValueError(f'{code!r} is not a valid country code!')
-
-    def get_patch_code(self) -> str:
-        """For apkpure"""
-        if self == CountryCode.JP:
-            return ""
-        else:
-            return self.value
-
-    def __str__(self):
-        return self.value
-
-
 class VersionURL(TypedDict):
     url: str
     extraURL: str
@@ -94,9 +42,44 @@ class UptodownVersion(TypedDict):
     titleKindFile: str
     versionURL: VersionURL
 
+class UptodownIndexEntry(TypedDict):
+    fileID: int
+    version: str
+    versionURL: VersionURL
 
-def get_uptodown(url: str, **kwargs: Any):
-    return requests.get(url, headers={'user-agent': "WWR's auto APK getter"}, **kwargs)
+class UptodownIndex(TypedDict):
+    app_id: str
+    updated: float
+    versions: list[UptodownIndexEntry]
+
+CACHE_DIR = './data/cache'
+UPTODOWN_TTL = 6 * 60 * 60
+UPTODOWN_JOBS = 8
+
+UPTODOWN_URL = 'https://{package_name}.en.uptodown.com'
+UPTODOWN_DOWNLOAD_URL = 'https://dw.uptodown.com/dwn/'
+UPTODOWN_HEADERS = {'user-agent': "WWR's auto APK getter"}
+
+client: AsyncClient | None = None
+# made on the shared loop the first time, since an asyncio.Lock made before
+# it can't be used on it in python 3.9
+index_lock: asyncio.Lock | None = None
+uptodown_indexes: dict[CountryCode, UptodownIndex] = {}
+
+def get_client() -> AsyncClient:
+    """
+    Shared client so repeated requests reuse their connections. Only use it
+    from coroutines run with `asynchttp.run`.
+    """
+    global client
+    if client is None:
+        client = AsyncClient(limit=UPTODOWN_JOBS * 2, headers=UPTODOWN_HEADERS)
+    return client
+
+async def parse_uptodown_page(url: str, parser: htmlscan.PageParser) -> int:
+    """Feed the page at `url` to `parser` as it downloads and return its size."""
+    async with await get_client().get(url) as res:
+        return await htmlscan.parse_chunks(parser, res.iter_chunks())
 
 def get_apkpure_versions_page(cc: CountryCode) -> str:
     if cc == CountryCode.JP:
@@ -120,135 +103,431 @@ def get_uptodown_pkg_name(country_code: CountryCode) -> str:
     elif country_code == CountryCode.TW:
         return "jp-co-ponos-battlecatstw"
 
-def get_uptodown_app_id(country_code: CountryCode) -> str | None:
+async def get_uptodown_app_id_async(country_code: CountryCode) -> str | None:
     package_name = get_uptodown_pkg_name(country_code)
-    url = f"https://{package_name}.en.uptodown.com/android/versions"
-    res = get_uptodown(url).text
-
-    data = res[res.find("detail-app-name"):]
-    code = 'data-code="'
-    data = data[data.find(code) + len(code):]
-    data = data[:data.find('"')]
+    url = UPTODOWN_URL.format(package_name=package_name) + "/android/versions"
+    parser = htmlscan.AttributeAfter('detail-app-name', 'data-code')
+    await parse_uptodown_page(url, parser)
+    return parser.value
 
-    return data
-
-def get_uptodown_apk_json(country_code: CountryCode) -> list[UptodownVersion]:
+def get_uptodown_app_id(country_code: CountryCode) -> str | None:
+    return asynchttp.run(get_uptodown_app_id_async(country_code))
+
+async def get_uptodown_versions_page_async(package_name: str, app_id: str, counter: int) -> list[UptodownVersion]:
+    url = UPTODOWN_URL.format(package_name=package_name) + f"/android/apps/{app_id}/versions/{counter}"
+    async with await get_client().get(url) as res:
+        return (await res.json()).get("data") or []
+
+async def get_uptodown_apk_json_async(
+    country_code: CountryCode,
+    app_id: str | None = None,
+    known: set[int] | None = None,
+    jobs: int = UPTODOWN_JOBS,
+) -> list[UptodownVersion]:
+    """
+    Walk the version pages `jobs` at a time until an empty page, or until a
+    page with a fileID from `known` shows that the rest is already known.
+    Only versions not in `known` are returned, newest first.
+    """
     package_name = get_uptodown_pkg_name(country_code)
-    app_id = get_uptodown_app_id(country_code)
+    if app_id is None:
+        app_id = await get_uptodown_app_id_async(country_code)
     if app_id is None:
         return []
+    known = known or set()
+
     counter = 0
+    # an update usually only adds to the first page
+    batch = 1 if known else jobs
     versions: list[UptodownVersion] = []
     while True:
-        url = f"https://{package_name}.en.uptodown.com/android/apps/{app_id}/versions/{counter}"
-        versions_data = get_uptodown(url).json().get("data")
-        if versions_data is None:
-            break
-        if len(versions_data) == 0:
+        pages = await asyncio.gather(*(
+            get_uptodown_versions_page_async(package_name, app_id, c)
+            for c in range(counter, counter + batch)
+        ))
+        done = False
+        for versions_data in pages:
+            if done:
+                continue
+            if len(versions_data) == 0:
+                done = True
+                continue
+            for version_data in versions_data:
+                if version_data['fileID'] in known:
+                    done = True
+                else:
+                    versions.append(version_data)
+        if done:
             break
-        for version_data in versions_data:
-            versions.append(version_data)
-        counter += 1
+        counter += batch
+        batch = jobs
     return versions
 
-def get_uptodown_download_url(version: str, country_code: CountryCode) -> str:
-    js = get_uptodown_apk_json(country_code)
-
-    n: list[str] = []
-    version_split = version.split('.')
-    for version2 in js:
-        for (n1, n2) in zip(version_split, version2['version'].split('.')):
-            if n1 != n2:
-                break
-        else:
-            v = version2['versionURL']
-            base = '/'.join([v['url'], v['extraURL'], str(v['versionID'])])
-            n.append(base + '-x')
+def get_uptodown_apk_json(
+    country_code: CountryCode,
+    app_id: str | None = None,
+    known: set[int] | None = None,
+    jobs: int = UPTODOWN_JOBS,
+) -> list[UptodownVersion]:
+    return asynchttp.run(get_uptodown_apk_json_async(country_code, app_id, known, jobs))
+
+async def get_uptodown_version_index_async(
+    country_code: CountryCode, ttl: float = UPTODOWN_TTL, refresh: bool = False
+) -> VersionIndex[UptodownIndexEntry]:
+    """
+    Versions of `country_code` on uptodown from the index in `CACHE_DIR`,
+    only rebuilt when they change. An index older than `ttl` seconds (or any
+    index if `refresh` is set) is updated by fetching only the pages with
+    versions it is missing. Concurrent downloads share a single lookup.
+    """
+    global index_lock
+    if index_lock is None:
+        index_lock = asyncio.Lock()
+    async with index_lock:
+        index = await _get_uptodown_index_async(country_code, ttl, refresh)
+        return cached_version_index(
+            ('uptodown', country_code),
+            index['updated'],
+            lambda: VersionIndex((v['version'], v) for v in index['versions']),
+        )
 
-    if len(n) == 0:
+def get_uptodown_version_index(
+    country_code: CountryCode, ttl: float = UPTODOWN_TTL, refresh: bool = False
+) -> VersionIndex[UptodownIndexEntry]:
+    return asynchttp.run(get_uptodown_version_index_async(country_code, ttl, refresh))
+
+def read_uptodown_index(path: str) -> UptodownIndex | None:
+    if not os.path.exists(path):
+        return None
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+def write_uptodown_index(path: str, index: UptodownIndex):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path + '.tmp', 'w', encoding='utf-8') as f:
+        json.dump(index, f)
+    os.replace(path + '.tmp', path)
+
+async def _get_uptodown_index_async(country_code: CountryCode, ttl: float, refresh: bool) -> UptodownIndex:
+    path = os.path.join(CACHE_DIR, f'uptodown-{country_code}.json')
+    index = uptodown_indexes.get(country_code)
+    if index is None:
+        index = await asyncio.to_thread(read_uptodown_index, path)
+        if index is not None:
+            uptodown_indexes[country_code] = index
+    if index is not None and not refresh and time.time() - index['updated'] < ttl:
+        return index
+
+    old: list[UptodownIndexEntry] = []
+    app_id = None
+    if index is not None:
+        # an empty app id was saved when the scrape found none
+        app_id = index['app_id'] or None
+        old = index['versions']
+    if app_id is None:
+        app_id = await get_uptodown_app_id_async(country_code)
+    if app_id is None:
+        raise ValueError(f'no app id on the uptodown versions page of {country_code}; interface changed')
+    known = {v['fileID'] for v in old}
+
+    with metrics.span('scrape', f'uptodown versions {country_code}') as span:
+        new = await get_uptodown_apk_json_async(country_code, app_id, known)
+        span.add(count=len(new))
+    index = {
+        'app_id': app_id,
+        'updated': time.time(),
+        'versions': [
+            {'fileID': v['fileID'], 'version': v['version'], 'versionURL': v['versionURL']}
+            for v in new
+        ] + old,
+    }
+
+    await asyncio.to_thread(write_uptodown_index, path, index)  # type: ignore
+    uptodown_indexes[country_code] = index  # type: ignore
+    return index  # type: ignore
+
+def uptodown_version_url(entry: UptodownIndexEntry) -> str:
+    v = entry['versionURL']
+    return '/'.join([v['url'], v['extraURL'], str(v['versionID'])]) + '-x'
+
+async def get_uptodown_download_url_async(version: str, country_code: CountryCode) -> str:
+    index = await get_uptodown_version_index_async(country_code)
+    entry = index.latest(version)
+    if entry is None:
+        # the version might be newer than the cached index
+        index = await get_uptodown_version_index_async(country_code, refresh=True)
+        entry = index.latest(version)
+
+    if entry is None:
         raise ValueError(
             f'Version {country_code}/{version!r} could not be found on uptodown. ' \
             f'You may want to manually download from {get_apkpure_versions_page(country_code)}.'
         )
 
-    res = get_uptodown(n[0]).text
-    data = res[res.find("detail-download-button"):]
-    code = 'data-url="'
-    data = data[data.find(code) + len(code):]
-    data = data[:data.find('"')]
-
-    return "https://dw.uptodown.com/dwn/" + data
-
-def to_data(data: Any) -> bytes:
-    if isinstance(data, str):
-        return data.encode("utf-8")
-    elif isinstance(data, bytes):
-        return data
-    elif isinstance(data, bool):
-        value = 1 if data else 0
-        return str(value).encode("utf-8")
-    elif isinstance(data, int):
-        return str(data).encode("utf-8")
-    elif data is None:
-        return b""
-    else:
-        raise TypeError(
-            f"data must be bytes, str, int, bool, Data, or None, not {type(data)}"
-        )
+    url = uptodown_version_url(entry)
+    parser = htmlscan.AttributeAfter('detail-download-button', 'data-url')
+    with metrics.span('scrape', f'uptodown {country_code}/{version}') as span:
+        span.add(bytes=await parse_uptodown_page(url, parser), count=1)
+    if parser.value is None:
+        raise ValueError(f'no download button on {url}; interface changed')
+
+    return UPTODOWN_DOWNLOAD_URL + parser.value
 
-def progress(
-    progress: float,
-    current: int,
-    total: int,
-    is_file_size: bool = False,
+def get_uptodown_download_url(version: str, country_code: CountryCode) -> str:
+    return asynchttp.run(get_uptodown_download_url_async(version, country_code))
+
+async def download_stream_async(
+    stream: asynchttp.Response,
+    abs_path: str,
+    sha256: str | None = None,
+    size: int | None = None,
+    chunk_size: int = 1024 * 1024,
 ):
-    total_bar_length = 50
-    if is_file_size:
-        current_str = FileSize(current).format()
-        total_str = FileSize(total).format()
-    else:
-        current_str = str(current)
-        total_str = str(total)
-    bar_length = int(total_bar_length * progress)
-    bar = "#" * bar_length + "-" * (total_bar_length - bar_length)
-    print(
-        f"\r[{bar}] {int(progress * 100)}% ({current_str}/{total_str})    ",
-        end="",
-    )
+    """
+    Write the body of `stream` to `abs_path` without holding it in memory.
+
+    Chunks go straight to `abs_path + '.part'`, which is only renamed to
+    `abs_path` once the download is complete and has been checked. If the
+    connection drops the partial file is kept so `download_ranged` can resume
+    it.
 
-def download_stream(stream: requests.Response, abs_path: str):
+    - sha256: expected hex digest of the file
+    - size: expected size in bytes, defaults to the content-length header
+    """
     _total_length = int(stream.headers.get("content-length"))  # type: ignore
+    if size is None:
+        size = _total_length
+    hasher = hashlib.sha256() if sha256 is not None else None
 
-    dl = 0
-    chunk_size = 1024
-    buffer: list[bytes] = []
-    for d in stream.iter_content(chunk_size=chunk_size):
-        dl += len(d)
-        buffer.append(d)
-        if progress is not None:
-            res = progress(dl / _total_length, dl, _total_length, True)
-            if res is not None and not res:
-                raise ValueError("Download stopped by download callback")
-
-    apk = to_data(b"".join(buffer))
     os.makedirs(os.path.dirname(abs_path), exist_ok=True)
+    part_path = abs_path + '.part'
 
-    with open(abs_path, "wb") as f:
-        f.write(apk)
-        print()
-        print(abs_path)
+    def write(f: BinaryIO, d: bytes):
+        f.write(d)
+        if hasher is not None:
+            hasher.update(d)
 
-def download_uptodown(version: str, country_code: CountryCode, containing_folder: str):
-    url = get_uptodown_download_url(version, country_code)
-    stream = get_uptodown(url, stream=True)
-    if stream.status_code == 404:
+    dl = 0
+    with metrics.span('download', os.path.basename(abs_path), total_bytes=_total_length) as span:
+        with open(part_path, "wb") as f:
+            try:
+                async for d in stream.iter_chunks(chunk_size):
+                    dl += len(d)
+                    # on a worker thread, so the other downloads on the loop keep going
+                    await asyncio.to_thread(write, f, d)
+                    span.add(bytes=len(d))
+            finally:
+                stream.close()
+
+    check_download(part_path, abs_path, dl, size, hasher, sha256)
+
+    os.replace(part_path, abs_path)
+    print(abs_path)
+
+def download_stream(stream: asynchttp.Response, abs_path: str, sha256: str | None = None, size: int | None = None):
+    asynchttp.run(download_stream_async(stream, abs_path, sha256, size))
+
+def check_download(part_path: str, abs_path: str, dl: int, size: int, hasher: Any, sha256: str | None):
+    """Discard `part_path` and raise if it is not the expected download."""
+    if dl != size:
+        os.remove(part_path)
+        raise ValueError(f"Downloaded {dl} bytes but expected {size}: {abs_path}")
+    if hasher is not None and hasher.hexdigest() != sha256.lower():  # type: ignore
+        os.remove(part_path)
+        raise ValueError(f"SHA-256 mismatch for {abs_path}")
+
+class HostLimiter:
+    """Caps how many downloads may run against the same host at once."""
+
+    def __init__(self, per_host: int):
+        self.per_host = per_host
+        self.lock = threading.Lock()
+        self.semaphores: dict[str, threading.BoundedSemaphore] = {}
+
+    def __call__(self, url: str) -> threading.BoundedSemaphore:
+        host = urllib.parse.urlsplit(url).hostname or ''
+        with self.lock:
+            if host not in self.semaphores:
+                self.semaphores[host] = threading.BoundedSemaphore(self.per_host)
+            return self.semaphores[host]
+
+async def fetch_range(
+    client: AsyncClient,
+    url: str,
+    path: str,
+    start: int,
+    end: int,
+    on_chunk: Callable[[int], Any],
+    stream: asynchttp.Response | None = None,
+    retries: int = 3,
+    chunk_size: int = 1024 * 1024,
+) -> bool:
+    """
+    Fetch bytes `[start, end)` of `url` into `path`, continuing from however
+    much of the range `path` already holds and retrying dropped connections.
+
+    `stream` is an already open response for the whole file that is used
+    instead of a new request when nothing has been fetched yet. Returns False
+    if the server ignored the Range header.
+    """
+    attempt = 0
+    while True:
+        have = os.path.getsize(path) if os.path.exists(path) else 0
+        if have > end - start:
+            os.truncate(path, end - start)
+            have = end - start
+        if start + have >= end:
+            if stream is not None:
+                stream.close()
+            return True
+
+        if stream is None or have or start:
+            if stream is not None:
+                stream.close()
+            stream = await client.get(url, headers={'Range': f'bytes={start + have}-{end - 1}'})
+            if stream.status != 206:
+                stream.close()
+                return False
+
+        remaining = end - start - have
+        chunks = stream.iter_chunks(chunk_size)
+        try:
+            with open(path, "ab") as f:
+                while remaining:
+                    # only the connection is retried, errors writing to disk aren't
+                    try:
+                        d = await chunks.__anext__()
+                    except StopAsyncIteration:
+                        break
+                    except asynchttp.DROPPED:
+                        attempt += 1
+                        if attempt > retries:
+                            raise
+                        break
+                    d = d[:remaining]
+                    await asyncio.to_thread(f.write, d)
+                    on_chunk(len(d))
+                    remaining -= len(d)
+        finally:
+            await chunks.aclose()
+            stream.close()
+        stream = None
+
+async def download_ranged_async(
+    url: str,
+    abs_path: str,
+    client: AsyncClient | None = None,
+    ranges: int = 1,
+    sha256: str | None = None,
+    retries: int = 3,
+):
+    """
+    Download `url` to `abs_path` using HTTP Range requests where the server
+    supports them, so that an interrupted download resumes from its `.part`
+    file instead of starting again. `client` defaults to the shared one.
+
+    With `ranges` > 1 the file is split into that many byte ranges which are
+    fetched at once and then joined on disk. Servers that reject Range get a
+    plain `download_stream_async`.
+    """
+    if client is None:
+        client = get_client()
+
+    stream = await client.get(url)
+    if stream.status == 404:
+        stream.close()
         raise ValueError(f"Download url returned 404: {url}")
+    if stream.headers.get("accept-ranges") != "bytes":
+        await download_stream_async(stream, abs_path, sha256)
+        return
+
+    size = int(stream.headers.get("content-length"))  # type: ignore
+    os.makedirs(os.path.dirname(abs_path), exist_ok=True)
+    bounds = [(size * i // ranges, size * (i + 1) // ranges) for i in range(ranges)]
+    part_paths = [abs_path + '.part' + (str(start) if start else '') for start, _ in bounds]
+    # parts are named after their start offset, so those left by a run with a
+    # different number of ranges don't line up and have to start again
+    for p in glob.glob(glob.escape(abs_path) + '.part*'):
+        if p not in part_paths and p[len(abs_path) + 5 :].isdigit():
+            os.remove(p)
+
+    span = metrics.span('download', os.path.basename(abs_path), total_bytes=size)
+    span.add(bytes=sum(
+        min(os.path.getsize(p), end - start)
+        for p, (start, end) in zip(part_paths, bounds)
+        if os.path.exists(p)
+    ))
+    def on_chunk(n: int):
+        span.add(bytes=n)
+
+    async def fetch(i: int) -> bool:
+        start, end = bounds[i]
+        return await fetch_range(
+            client, url, part_paths[i], start, end, on_chunk, stream if i == 0 else None, retries  # type: ignore
+        )
+
+    with span:
+        ok = await asyncio.gather(*(fetch(i) for i in range(ranges)))
+
+    if not all(ok):
+        print(f"Server rejected Range requests, downloading {abs_path} in one go")
+        for p in part_paths:
+            if os.path.exists(p):
+                os.remove(p)
+        await download_stream_async(await client.get(url), abs_path, sha256)
+        return
+
+    def finish():
+        with open(part_paths[0], "ab") as out:
+            for p in part_paths[1:]:
+                with open(p, "rb") as f:
+                    shutil.copyfileobj(f, out, 1024 * 1024)
+                os.remove(p)
+
+        hasher = None
+        if sha256 is not None:
+            hasher = hashlib.sha256()
+            with open(part_paths[0], "rb") as f:
+                for d in iter(lambda: f.read(1024 * 1024), b""):
+                    hasher.update(d)
+        check_download(part_paths[0], abs_path, os.path.getsize(part_paths[0]), size, hasher, sha256)
+
+        os.replace(part_paths[0], abs_path)
+
+    # joining and hashing would hold up every other download on the loop
+    await asyncio.to_thread(finish)
+    print(abs_path)
+
+def download_ranged(
+    url: str,
+    abs_path: str,
+    client: AsyncClient | None = None,
+    ranges: int = 1,
+    sha256: str | None = None,
+    retries: int = 3,
+    limiter: HostLimiter | None = None,
+):
+    """`download_ranged_async`, at most `limiter` per host at once if given."""
+    if limiter is not None:
+        with limiter(url):
+            return download_ranged(url, abs_path, client, ranges, sha256, retries)
+    asynchttp.run(download_ranged_async(url, abs_path, client, ranges, sha256, retries))
+
+def download_uptodown(
+    version: str,
+    country_code: CountryCode,
+    containing_folder: str,
+    ranges: int = 1,
+    limiter: HostLimiter | None = None,
+) -> str:
+    url = get_uptodown_download_url(version, country_code)
     filename = f'{country_code}-{version}.apk'
     abs_path = os.path.join(containing_folder, filename)
 
-    download_stream(stream, abs_path)
+    download_ranged(url, abs_path, None, ranges, limiter=limiter)
+    return abs_path
 
-def get_apkpure_versions(country_code: CountryCode) -> list[str]:
+async def get_apkpure_versions_async(country_code: CountryCode) -> list[str]:
     import cloudscraper
     url = get_apkpure_versions_page(country_code)
 
@@ -262,30 +541,20 @@ def get_apkpure_versions(country_code: CountryCode) -> list[str]:
     # })
     # should realistically do some looping thing between different scrapers
 
-    res = scraper.get(url)
-    html = res.text
+    # cloudflare checks need what cloudscraper does, so it makes the request
+    parser = htmlscan.ApkpureVersions()
+    with metrics.span('scrape', f'apkpure versions {country_code}') as span:
+        async with await AsyncClient(scraper).get(url) as res:
+            span.add(bytes=await htmlscan.parse_chunks(parser, res.iter_chunks()), count=1)
 
-    if "<title>Just a moment...</title>" in html:
+    if parser.title.strip() == 'Just a moment...':
         raise ValueError('apkpure request blocked by cloudflare')
-        # quit(html)
 
-    lists = re.findall(r'<ul[^>]*ver-wrap[^>]*>(?:.|\n)*?</ul>', html)
-    # ver-wrap class
+    return sorted(dict.fromkeys(parser.versions), reverse=True)
 
-    versions: list[str] = []
-    for ls in lists:
-        items = re.findall(r'<li[^>]*>(?:.|\n)*?</li>', ls)
-        for item in items:
-            link_s = re.search(r'<a(?:[^>]|\n)*>', item)
-            if not link_s:
-                continue
-            link = link_s.group(0)
-            ver = re.search(r'data-dt-version="([^"]*)"', link)
-            if not ver:
-                raise ValueError('interface changed; code needs to be updated')
-            versions.append(ver.group(1))
-
-    return sorted(dict.fromkeys(versions), reverse=True)
+@functools.lru_cache
+def get_apkpure_versions(country_code: CountryCode) -> list[str]:
+    return asynchttp.run(get_apkpure_versions_async(country_code))
 
 def get_gv_int(game_version: str) -> int:
     split_gv = game_version.split(".")
@@ -297,28 +566,98 @@ def get_gv_int(game_version: str) -> int:
 
     return int(final)
 
-def get_apkpure_dl_link(version: str, country_code: CountryCode) -> str:
+def version_parts(version: str) -> tuple[int, ...]:
+    """'14.7.1' -> (14, 7, 1), ignoring anything that isn't a digit."""
+    return tuple(int(''.join(c for c in part if c.isdigit()) or 0) for part in version.split('.'))
+
+def version_key(version: str) -> tuple[int, ...]:
+    """
+    What versions are sorted by: like `get_gv_int`, a version without a
+    patch number counts as .0, so '14.7' and '14.7.0' are the same.
+    """
+    parts = version_parts(version)
+    return parts + (0,) * (3 - len(parts))
+
+T = TypeVar('T')
+
+class VersionIndex(Generic[T]):
+    """
+    Versions with something attached to each (e.g. where to download it),
+    sorted by `version_key` so that prefix and range queries are binary
+    searches. Results are oldest first. If a version is listed more than
+    once, the first listing counts as the newest.
+    """
+
+    def __init__(self, entries: Iterable[tuple[str, T]]):
+        ordered = sorted(
+            ((version_key(version), -i, version, item) for i, (version, item) in enumerate(entries)),
+            key=lambda entry: entry[:2],
+        )
+        self.keys = [key for key, _, _, _ in ordered]
+        self.versions = [version for _, _, version, _ in ordered]
+        self.items = [item for _, _, _, item in ordered]
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    def __iter__(self) -> Iterator[tuple[str, T]]:
+        return zip(self.versions, self.items)
+
+    def prefix_range(self, prefix: str) -> tuple[int, int]:
+        """Where the versions starting with `prefix` are, e.g. '14' for all of 14.x."""
+        parts = version_parts(prefix)
+        lo = bisect.bisect_left(self.keys, parts)
+        hi = bisect.bisect_left(self.keys, parts[:-1] + (parts[-1] + 1,))
+        return lo, hi
+
+    def latest(self, prefix: str) -> T | None:
+        """The newest version starting with `prefix`, e.g. the latest 14.x for '14'."""
+        lo, hi = self.prefix_range(prefix)
+        return self.items[hi - 1] if hi > lo else None
+
+    def between(self, start: str | None = None, end: str | None = None) -> list[tuple[str, T]]:
+        """
+        Versions from `start` onwards up to and including everything starting
+        with `end`, e.g. ('13.0', None) for all since 13.0 or ('13.0', '14')
+        for 13.0 up to the last 14.x.
+        """
+        lo = bisect.bisect_left(self.keys, version_parts(start)) if start else 0
+        hi = self.prefix_range(end)[1] if end else len(self.keys)
+        return list(zip(self.versions[lo:hi], self.items[lo:hi]))
+
+version_indexes: dict[tuple[str, CountryCode], tuple[Any, VersionIndex[Any]]] = {}
+
+def cached_version_index(key: tuple[str, CountryCode], stamp: Any, build: Callable[[], VersionIndex[T]]) -> VersionIndex[T]:
+    """The index for `key`, built again only if `stamp` has changed."""
+    cached = version_indexes.get(key)
+    if cached is None or cached[0] != stamp:
+        cached = (stamp, build())
+        version_indexes[key] = cached
+    return cached[1]
+
+def get_apkpure_version_index(country_code: CountryCode) -> VersionIndex[str]:
     versions = get_apkpure_versions(country_code)
+    return cached_version_index(('apkpure', country_code), id(versions), lambda: VersionIndex((v, v) for v in versions))
 
-    version_split = version.split('.')
-    to_download: list[str] = []
-    for version2 in versions:
-        for (n1, n2) in zip(version_split, version2.split('.')):
-            if n1 != n2:
-                break
-        else:
-            to_download.append(version2)
+def get_apkpure_dl_link(version: str, country_code: CountryCode) -> str:
+    to_download = get_apkpure_version_index(country_code).latest(version)
 
-    if len(to_download) == 0:
+    if to_download is None:
         raise ValueError(
             f'Version {country_code}/{version!r} could not be found on apkpure.'
         )
 
-    ver = str(get_gv_int(to_download[0])) + '0'
+    ver = str(get_gv_int(to_download)) + '0'
     vendor = 'jp.co.ponos.battlecats' + country_code.get_patch_code()
     return f"https://d.apkpure.com/b/XAPK/{vendor}?versionCode={ver}"
 
-def download_apkpure(version: str, country_code: CountryCode, containing_folder: str):
+def download_apkpure(
+    version: str,
+    country_code: CountryCode,
+    containing_folder: str,
+    ranges: int = 1,
+    limiter: HostLimiter | None = None,
+) -> str:
     print(f'Version {country_code}/{version!r} could not be found on uptodown. Trying apkpure.')
     try:
         import cloudscraper
@@ -334,36 +673,141 @@ def download_apkpure(version: str, country_code: CountryCode, containing_folder:
         "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/83.0.4103.116 Safari/537.36"
     })
 
-    stream = scraper.get(url, stream=True, timeout=10)
-    if stream.status_code == 404:
-        raise ValueError(f"Download url returned 404: {url}")
     filename = f'{country_code}-{version}.apk'
     abs_path = os.path.join(containing_folder, filename)
 
-    download_stream(stream, abs_path)
+    download_ranged(url, abs_path, AsyncClient(scraper, timeout=10), ranges, limiter=limiter)
+    return abs_path
+
+def download(
+    version: str,
+    country_code: CountryCode,
+    containing_folder: str,
+    ranges: int = 1,
+    limiter: HostLimiter | None = None,
+) -> str:
+    """Download from uptodown, falling back to apkpure. Returns the apk path."""
+    try:
+        return download_uptodown(version, country_code, containing_folder, ranges, limiter)
+    except ValueError as e:
+        print(e)
+        return download_apkpure(version, country_code, containing_folder, ranges, limiter)
+
+def download_batch(
+    jobs: list[tuple[str, CountryCode]],
+    containing_folder: str,
+    workers: int = 4,
+    per_host: int = 2,
+    ranges: int = 1,
+):
+    """
+    Download every `(version, country_code)` in `jobs` with `workers` threads,
+    at most `per_host` of them talking to the same host at once, then print a
+    summary of what was downloaded and how fast.
+    """
+    limiter = HostLimiter(per_host)
+
+    def run(job: tuple[str, CountryCode]) -> tuple[int, float, str | None]:
+        version, cc = job
+        start = time.perf_counter()
+        try:
+            path = download(version, cc, containing_folder, ranges, limiter)
+            return os.path.getsize(path), time.perf_counter() - start, None
+        except Exception as e:
+            return 0, time.perf_counter() - start, f'{type(e).__name__}: {e}'
+
+    # the summary below replaces the bars, which several downloads at once
+    # would draw over each other
+    sink = metrics.sink
+    if isinstance(sink, metrics.BarSink) and sink.is_tty():
+        metrics.sink = metrics.QuietSink()
+    start = time.perf_counter()
+    try:
+        with ThreadPoolExecutor(workers) as executor:
+            results = list(executor.map(run, jobs))
+    finally:
+        metrics.sink = sink
+    elapsed = time.perf_counter() - start
+
+    total = sum(size for size, _, _ in results)
+    ok = sum(error is None for _, _, error in results)
+    print()
+    print(
+        f'Downloaded {ok}/{len(jobs)} apks, {FileSize(total)} in {elapsed:.1f}s '
+        f'({FileSize(int(total / max(elapsed, 1e-6)))}/s)'
+    )
+    for (version, cc), (size, took, error) in zip(jobs, results):
+        if error is None:
+            print(f'  {cc}-{version}: {FileSize(size)} in {took:.1f}s ({FileSize(int(size / max(took, 1e-6)))}/s)')
+        else:
+            print(f'  {cc}-{version}: failed, {error}')
+
+def expand_versions(spec: str, country_code: CountryCode) -> list[str]:
+    """
+    `13.0..14` is every version on uptodown from 13.0 up to the last 14.x,
+    oldest first, and `13.0..` every version since 13.0. Anything else is
+    just itself.
+    """
+    if '..' not in spec:
+        return [spec]
+    start, _, end = spec.partition('..')
+    versions = get_uptodown_version_index(country_code).between(start or None, end or None)
+    return list(dict.fromkeys(version for version, _ in versions))
+
+def read_batch_manifest(path: str) -> list[tuple[str, CountryCode]]:
+    """Lines of `<version_num> <country_code>`, with `#` comments."""
+    jobs: list[tuple[str, CountryCode]] = []
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            line = line.partition('#')[0].split()
+            if not line:
+                continue
+            version, cc = line
+            jobs.append((version, CountryCode.from_cc(cc)))
+    return jobs
+
 
 
 if __name__ == '__main__':
-    try:
-        version = sys.argv[1]
-        cc = sys.argv[2]
-    except IndexError:
-        quit("Usage: python download.py <version_num> <country_code>")
+    args = sys.argv[1:]
+    metrics.configure(pop_option(args, '--metrics'))
+    ranges = int(pop_option(args, '--ranges', '1'))  # type: ignore
+    workers = int(pop_option(args, '--jobs', '4'))  # type: ignore
+    per_host = int(pop_option(args, '--per-host', '2'))  # type: ignore
+    manifest = pop_option(args, '--batch')
+    usage = (
+        "Usage: python download.py <version_num> <country_code> [<containing_folder>] [--ranges <n>]\n"
+        "       python download.py <version_num>,... <country_code>,... [<containing_folder>] [--jobs <n>] [--per-host <n>]\n"
+        "       python download.py <from>..<to> <country_code> ...    every version from <from> up to the last <to>.x\n"
+        "       python download.py --batch <manifest> [<containing_folder>] [--jobs <n>] [--per-host <n>]"
+    )
+
+    if manifest is None:
+        try:
+            versions = args.pop(0).split(',')
+            ccs = [CountryCode.from_cc(cc) for cc in args.pop(0).split(',')]
+        except IndexError:
+            quit(usage)
+        jobs = [(version, cc) for cc in ccs for version in versions]
+    else:
+        jobs = read_batch_manifest(manifest)
+    jobs = [(version, cc) for spec, cc in jobs for version in expand_versions(spec, cc)]
+    if not jobs:
+        quit('No versions on uptodown match that range')
 
     try:
-        containing_folder = sys.argv[3]
+        containing_folder = args[0]
     except IndexError:
         containing_folder = os.getcwd() + '/data/apk'
         print(f'Using default containing folder: {containing_folder!r}')
 
-    cc = CountryCode.from_cc(cc)
+    if manifest is not None or len(jobs) > 1:
+        download_batch(jobs, containing_folder, workers, per_host, ranges)
+        quit()
 
+    [(version, cc)] = jobs
     try:
-        download_uptodown(version, cc, containing_folder)
-    except ValueError as e:
-        print(e)
-        try:
-            download_apkpure(version, cc, containing_folder)
-        except (ValueError, TypeError) as e:
-            print(f'Error when trying to download from apkpure: {traceback.format_exc()}')
-            print(f'Try manually downloading the apk (e.g. see {get_apkpure_versions_page(cc)})')
+        download(version, cc, containing_folder, ranges)
+    except (ValueError, TypeError) as e:
+        print(f'Error when trying to download from apkpure: {traceback.format_exc()}')
+        print(f'Try manually downloading the apk (e.g. see {get_apkpure_versions_page(cc)})')
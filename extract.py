@@ -1,32 +1,39 @@
-import zipfile
 import os
 import sys
-import io
+from concurrent.futures import ThreadPoolExecutor
+import metrics
+from apkfile import open_inner_apk
+from core import pop_option
 
-INNER_APK = 'InstallPack.apk'
 INNER_FOLDER = 'assets/'
 
-apk_to_read = os.path.expanduser(sys.argv[1])
+args = sys.argv[1:]
+metrics.configure(pop_option(args, '--metrics'))
+jobs = int(pop_option(args, '--jobs', '1'))  # type: ignore
+if len(args) < 1:
+    print('Usage: python extract.py <to_read> [--jobs <n>]')
 
-files = {}
-with zipfile.ZipFile(apk_to_read) as outer:
-    inner = io.BytesIO(outer.read(INNER_APK))
-    with zipfile.ZipFile(inner) as apk:
-        for fileinfo in apk.infolist():
-            if not fileinfo.filename.startswith(INNER_FOLDER):
-                continue
-
-            with apk.open(fileinfo) as fd:
-                content = fd.read()
-                files[fileinfo.filename] = content
+apk_to_read = os.path.expanduser(args[0])
 
 extracted_name = os.path.basename(apk_to_read.rstrip('.apk'))
 output_dir = os.path.join('./data/extracted', extracted_name)
 print("Extracting to", os.path.abspath(output_dir))
 
-os.makedirs(output_dir, exist_ok=True)
-for name, content in files.items():
-    path = os.path.join(output_dir, name)
-    os.makedirs(os.path.dirname(path), exist_ok=True)
-    with open(path, 'wb') as f:
-        f.write(content)
+# every asset is copied straight from the apk to disk a chunk at a time, so
+# none of them is ever held in memory whole
+with open_inner_apk(apk_to_read) as apk:
+    infos = [
+        fileinfo
+        for fileinfo in apk.zip.infolist()
+        if fileinfo.filename.startswith(INNER_FOLDER) and not fileinfo.is_dir()
+    ]
+
+    with metrics.span('extract', extracted_name, total_count=len(infos)) as span:
+        def extract(fileinfo):
+            path = os.path.join(output_dir, fileinfo.filename)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            apk.extract(fileinfo, path)
+            span.add(bytes=fileinfo.file_size, count=1)
+
+        with ThreadPoolExecutor(jobs) as executor:
+            list(executor.map(extract, infos))
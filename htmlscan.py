@@ -0,0 +1,140 @@
+"""
+Single-pass extractors for the few values download needs from apkpure and
+uptodown pages. They are built on `html.parser`, so they only look at tags
+and attributes, not at how the markup around them is laid out, and they
+can be fed a page a chunk at a time as it downloads.
+"""
+
+from __future__ import annotations
+
+import codecs
+import html.parser
+from typing import AsyncIterator, Optional, TypeVar
+
+P = TypeVar('P', bound='PageParser')
+FEED_SIZE = 64 * 1024
+
+
+class PageParser(html.parser.HTMLParser):
+    """
+    Keeps the page's `<title>`. Subclasses look at each start tag in `start`
+    and set `done` once they've found everything, so the rest of the page
+    isn't parsed.
+    """
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.title = ''
+        self.in_title = False
+        self.done = False
+
+    def handle_starttag(self, tag: str, attrs: list[tuple[str, Optional[str]]]):
+        if tag == 'title':
+            self.in_title = True
+        self.start(tag, {name: value or '' for name, value in attrs})
+
+    def handle_startendtag(self, tag: str, attrs: list[tuple[str, Optional[str]]]):
+        self.start(tag, {name: value or '' for name, value in attrs})
+
+    def handle_endtag(self, tag: str):
+        if tag == 'title':
+            self.in_title = False
+        self.end(tag)
+
+    def handle_data(self, data: str):
+        if self.in_title:
+            self.title += data
+
+    def start(self, tag: str, attrs: dict[str, str]):
+        pass
+
+    def end(self, tag: str):
+        pass
+
+
+class ApkpureVersions(PageParser):
+    """
+    The `data-dt-version` of the first link in each item of an apkpure
+    versions list, i.e. a `<ul>` with a `ver-wrap` class.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.versions: list[str] = []
+        # how many lists deep inside a ver-wrap list, 0 when outside one
+        self.depth = 0
+        self.in_item = False
+        self.item_has_link = False
+
+    def start(self, tag: str, attrs: dict[str, str]):
+        if tag == 'ul':
+            if self.depth or 'ver-wrap' in attrs.get('class', ''):
+                self.depth += 1
+        elif not self.depth:
+            return
+        elif tag == 'li':
+            self.in_item = True
+            self.item_has_link = False
+        elif tag == 'a' and self.in_item and not self.item_has_link:
+            self.item_has_link = True
+            if 'data-dt-version' not in attrs:
+                raise ValueError('interface changed; code needs to be updated')
+            self.versions.append(attrs['data-dt-version'])
+
+    def end(self, tag: str):
+        if tag == 'ul' and self.depth:
+            self.depth -= 1
+        elif tag == 'li':
+            self.in_item = False
+
+
+class AttributeAfter(PageParser):
+    """
+    The first `attribute` on the element whose id or one of whose classes is
+    `marker`, or on an element after it, e.g. uptodown's app id in the
+    `data-code` at `detail-app-name`.
+    """
+
+    def __init__(self, marker: str, attribute: str):
+        super().__init__()
+        self.marker = marker
+        self.attribute = attribute
+        self.found_marker = False
+        self.value: Optional[str] = None
+
+    def start(self, tag: str, attrs: dict[str, str]):
+        if self.value is not None:
+            return
+        if not self.found_marker:
+            self.found_marker = attrs.get('id') == self.marker or self.marker in attrs.get('class', '').split()
+        if self.found_marker and self.attribute in attrs:
+            self.value = attrs[self.attribute]
+            self.done = True
+
+
+def parse_page(parser: P, page: str) -> P:
+    """Feed `page` to `parser` until it is done."""
+    for i in range(0, len(page), FEED_SIZE):
+        if parser.done:
+            return parser
+        parser.feed(page[i : i + FEED_SIZE])
+    parser.close()
+    return parser
+
+
+async def parse_chunks(parser: PageParser, chunks: AsyncIterator[bytes]) -> int:
+    """
+    Feed `parser` a UTF-8 page as its chunks arrive, without keeping the
+    whole page. The rest of the page is still read once `parser` is done,
+    so the connection can be reused. Returns how many bytes there were.
+    """
+    decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+    size = 0
+    async for chunk in chunks:
+        size += len(chunk)
+        if not parser.done:
+            parser.feed(decoder.decode(chunk))
+    if not parser.done:
+        parser.feed(decoder.decode(b'', final=True))
+        parser.close()
+    return size
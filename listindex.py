@@ -0,0 +1,158 @@
+"""The entries of a decrypted .list file as a compact, checked index"""
+
+from __future__ import annotations
+
+import os
+import struct
+import sys
+from array import array
+from typing import Iterator
+
+MAGIC = b'MBCI'
+HEADER = struct.Struct('<4sIQ')
+
+
+class ListIndex:
+    """
+    Entry `i` of a pack is called `names[i]` and is `lengths[i]` bytes from
+    `offsets[i]` onwards. Offsets and lengths are kept in arrays rather than
+    a list of rows, so even the biggest packs only take a few bytes per entry.
+    """
+
+    def __init__(self, names: list[str], offsets: array, lengths: array):
+        self.names = names
+        self.offsets = offsets
+        self.lengths = lengths
+        self.by_name: dict[str, int] | None = None
+
+    @staticmethod
+    def parse(list_data: str) -> "ListIndex":
+        """
+        Parse the decrypted text of a .list file: a line with the number of
+        entries, then `name,offset,length` for each. Lines with fewer than
+        three fields are skipped.
+        """
+        names: list[str] = []
+        offsets: list[str] = []
+        lengths: list[str] = []
+        for line in list_data.split('\n'):
+            fields = line.split(',')
+            if len(fields) < 3:
+                continue
+            names.append(fields[0])
+            offsets.append(fields[1])
+            lengths.append(fields[2])
+        try:
+            return ListIndex(names, array('q', map(int, offsets)), array('q', map(int, lengths)))
+        except ValueError:
+            for i, (offset, length) in enumerate(zip(offsets, lengths)):
+                for value in (offset, length):
+                    try:
+                        int(value)
+                    except ValueError:
+                        raise ValueError(f'{names[i]}: {value.strip()!r} is not a valid offset or length') from None
+            raise
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    def __iter__(self) -> Iterator[tuple[str, int, int]]:
+        return zip(self.names, self.offsets, self.lengths)
+
+    def __contains__(self, name: str) -> bool:
+        return name in self.positions()
+
+    def positions(self) -> dict[str, int]:
+        """Where each name is in `names`, built the first time it is needed."""
+        if self.by_name is None:
+            self.by_name = {name: i for i, name in enumerate(self.names)}
+        return self.by_name
+
+    def find(self, name: str) -> tuple[int, int]:
+        """`(offset, length)` of `name`, or KeyError."""
+        i = self.positions()[name]
+        return self.offsets[i], self.lengths[i]
+
+    def validate(self, pack_size: int):
+        """
+        Raise ValueError unless every entry lies inside a pack of `pack_size`
+        bytes, no two entries overlap and no name is used twice.
+        """
+        if len(self.positions()) != len(self.names):
+            seen: set[str] = set()
+            for name in self.names:
+                if name in seen:
+                    raise ValueError(f'{name} is listed more than once')
+                seen.add(name)
+
+        for name, offset, length in self:
+            if offset < 0 or length < 0 or offset + length > pack_size:
+                raise ValueError(
+                    f'{name}: {length} bytes at {offset} is outside of the pack ({pack_size} bytes)'
+                )
+
+        order = sorted(range(len(self.names)), key=self.offsets.__getitem__)
+        end = 0
+        previous = None
+        for i in order:
+            if self.lengths[i] == 0:
+                continue
+            if self.offsets[i] < end:
+                raise ValueError(f'{self.names[i]} overlaps {previous}')
+            end = self.offsets[i] + self.lengths[i]
+            previous = self.names[i]
+
+    def to_bytes(self) -> bytes:
+        """
+        `MBCI`, a format version and the number of entries, then the offsets
+        and lengths as little-endian int64s, then the names separated by
+        newlines.
+        """
+        offsets, lengths = array('q', self.offsets), array('q', self.lengths)
+        if sys.byteorder == 'big':
+            offsets.byteswap()
+            lengths.byteswap()
+        return (
+            HEADER.pack(MAGIC, 1, len(self.names))
+            + offsets.tobytes()
+            + lengths.tobytes()
+            + '\n'.join(self.names).encode('utf-8')
+        )
+
+    @staticmethod
+    def from_bytes(data: bytes) -> "ListIndex":
+        magic, format_version, count = HEADER.unpack_from(data)
+        if magic != MAGIC or format_version != 1:
+            raise ValueError('not a list index')
+        start = HEADER.size
+        offsets, lengths = array('q'), array('q')
+        offsets.frombytes(data[start : start + 8 * count])
+        lengths.frombytes(data[start + 8 * count : start + 16 * count])
+        if sys.byteorder == 'big':
+            offsets.byteswap()
+            lengths.byteswap()
+        names = data[start + 16 * count :].decode('utf-8').split('\n') if count else []
+        if len(names) != count or len(offsets) != count or len(lengths) != count:
+            raise ValueError('list index is truncated')
+        return ListIndex(names, offsets, lengths)
+
+
+def index_path(targ_base_path: str) -> str:
+    """e.g. ./data/decrypted/en-15.0/DataLocal.index"""
+    return targ_base_path.rstrip('/\\') + '.index'
+
+
+def read_index(targ_base_path: str) -> ListIndex | None:
+    """The index saved by `write_index` next to a decrypted pack, if any."""
+    path = index_path(targ_base_path)
+    if not os.path.exists(path):
+        return None
+    with open(path, 'rb') as f:
+        return ListIndex.from_bytes(f.read())
+
+
+def write_index(targ_base_path: str, index: ListIndex):
+    path = index_path(targ_base_path)
+    with open(path + '.tmp', 'wb') as f:
+        f.write(index.to_bytes())
+    os.replace(path + '.tmp', path)
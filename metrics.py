@@ -0,0 +1,256 @@
+"""
+Timing of the phases of downloading and decrypting (scrape, download, zip
+read, list decrypt, pack decrypt, write), reported to a pluggable sink.
+
+The sink is picked with `configure`, e.g. from a script's `--metrics` option
+or the MINI_BC_METRICS environment variable:
+
+- bar: progress bars on a terminal, one summary line per pack/download
+  otherwise (the default)
+- json or json:<path>: a JSON line for every finished span, on stderr or
+  appended to <path>
+- quiet: nothing
+"""
+
+from __future__ import annotations
+
+import atexit
+import json
+import os
+import sys
+import threading
+import time
+from typing import Any, Optional, TextIO
+
+
+# https://codeberg.org/fieryhenry/tbcml/src/branch/master/src/tbcml/io/file_handler.py
+class FileSize:
+    def __init__(self, file_size: int):
+        self.file_size = file_size
+
+    def __str__(self) -> str:
+        return self.format()
+
+    def __repr__(self) -> str:
+        return self.format()
+
+    def format(self) -> str:
+        if self.file_size < 1024:
+            return f"{self.file_size} B"
+        elif self.file_size < 1024**2:
+            return f"{self.file_size / 1024:.2f} KiB"
+        elif self.file_size < 1024**3:
+            return f"{self.file_size / 1024 ** 2:.2f} MiB"
+        elif self.file_size < 1024**4:
+            return f"{self.file_size / 1024 ** 3:.2f} GiB"
+        else:
+            return f"{self.file_size / 1024 ** 4:.2f} TiB"
+
+
+def progress_bar(
+    progress: float,
+    current: int,
+    total: int,
+    is_file_size: bool = False,
+) -> str:
+    total_bar_length = 50
+    if is_file_size:
+        current_str = FileSize(current).format()
+        total_str = FileSize(total).format()
+    else:
+        current_str = str(current)
+        total_str = str(total)
+    bar_length = int(total_bar_length * progress)
+    bar = "#" * bar_length + "-" * (total_bar_length - bar_length)
+    return f"\r[{bar}] {int(progress * 100)}% ({current_str}/{total_str})    "
+
+
+class Span:
+    """
+    One phase of work on one thing, e.g. ("pack decrypt", "DataLocal").
+    `bytes` and `count` grow with `add`; `busy` adds up time spent in
+    pieces, for phases like writing that are interleaved with others.
+    """
+
+    def __init__(
+        self,
+        phase: str,
+        name: str,
+        total_bytes: Optional[int],
+        total_count: Optional[int],
+        sink: "Sink",
+    ):
+        self.phase = phase
+        self.name = name
+        self.total_bytes = total_bytes
+        self.total_count = total_count
+        self.bytes = 0
+        self.count = 0
+        self.busy = 0.0
+        self.start = time.perf_counter()
+        self.seconds: Optional[float] = None
+        self.sink = sink
+        self.lock = threading.Lock()
+        sink.start(self)
+
+    def __enter__(self) -> "Span":
+        return self
+
+    def __exit__(self, *_: Any):
+        self.end()
+
+    def add(self, bytes: int = 0, count: int = 0, busy: float = 0.0):
+        with self.lock:
+            self.bytes += bytes
+            self.count += count
+            self.busy += busy
+        self.sink.update(self)
+
+    def end(self):
+        if self.seconds is None:
+            self.seconds = time.perf_counter() - self.start
+            self.sink.end(self)
+
+    def elapsed(self) -> float:
+        return self.seconds if self.seconds is not None else time.perf_counter() - self.start
+
+    def has_total(self) -> bool:
+        return self.total_bytes is not None or self.total_count is not None
+
+    def to_dict(self) -> dict[str, Any]:
+        return {
+            'phase': self.phase,
+            'name': self.name,
+            'bytes': self.bytes,
+            'count': self.count,
+            'seconds': round(self.elapsed(), 6),
+            'busy': round(self.busy, 6),
+        }
+
+
+class Sink:
+    """Does nothing; the base for the other sinks."""
+
+    def start(self, span: Span):
+        pass
+
+    def update(self, span: Span):
+        pass
+
+    def end(self, span: Span):
+        pass
+
+
+class QuietSink(Sink):
+    pass
+
+
+class BarSink(Sink):
+    """
+    Redraws a progress bar at most every `interval` seconds for spans with a
+    total. When `stream` is not a terminal there are no bars, just a summary
+    line when each of those spans ends.
+    """
+
+    def __init__(self, stream: Optional[TextIO] = None, interval: float = 0.1):
+        # sys.stdout as it is now, not when this module was imported
+        self.stream = stream or sys.stdout
+        self.interval = interval
+        self.last = 0.0
+        self.lock = threading.Lock()
+        # isatty is a system call, too slow to make on every update
+        self.tty = self.stream.isatty()
+
+    def is_tty(self) -> bool:
+        return self.tty
+
+    def draw(self, span: Span):
+        if span.total_bytes is not None:
+            current, total, is_file_size = span.bytes, span.total_bytes, True
+        else:
+            current, total, is_file_size = span.count, span.total_count or 0, False
+        fraction = min(current / total, 1) if total else 1
+        self.stream.write(progress_bar(fraction, current, total, is_file_size))
+        self.stream.flush()
+
+    def update(self, span: Span):
+        if not span.has_total() or not self.is_tty():
+            return
+        now = time.perf_counter()
+        with self.lock:
+            if now - self.last < self.interval:
+                return
+            self.last = now
+            self.draw(span)
+
+    def end(self, span: Span):
+        if not span.has_total():
+            return
+        with self.lock:
+            if self.is_tty():
+                self.draw(span)
+                self.stream.write("\n")
+            else:
+                rate = FileSize(int(span.bytes / max(span.elapsed(), 1e-6)))
+                files = f"{span.count} files, " if span.total_count is not None else ""
+                self.stream.write(
+                    f"{span.phase} {span.name}: {files}{FileSize(span.bytes)} "
+                    f"in {span.elapsed():.2f}s ({rate}/s)\n"
+                )
+            self.stream.flush()
+
+
+class JsonSink(Sink):
+    """A JSON line for every span that ends, written to `stream`."""
+
+    def __init__(self, stream: TextIO = sys.stderr):
+        self.stream = stream
+        self.lock = threading.Lock()
+
+    def end(self, span: Span):
+        line = json.dumps(span.to_dict())
+        with self.lock:
+            self.stream.write(line + "\n")
+            self.stream.flush()
+
+
+sink: Sink = BarSink()
+# what a json:<path> sink writes to, closed when the sink is replaced
+sink_file: Optional[TextIO] = None
+
+
+def configure(spec: Optional[str]):
+    """Set the sink from a spec like `bar`, `json`, `json:<path>` or `quiet`."""
+    global sink, sink_file
+    if not spec:
+        return
+    kind, _, path = spec.partition(':')
+    stream = None
+    if kind == 'bar':
+        new_sink: Sink = BarSink()
+    elif kind == 'quiet':
+        new_sink = QuietSink()
+    elif kind == 'json':
+        stream = open(path, 'a', encoding='utf-8') if path else None
+        new_sink = JsonSink(stream or sys.stderr)
+    else:
+        raise ValueError(f'{spec!r} is not a valid metrics sink, use bar, json, json:<path> or quiet')
+    close()
+    sink, sink_file = new_sink, stream
+
+
+def close():
+    """Close the file of a `json:<path>` sink, if there is one."""
+    global sink_file
+    if sink_file is not None:
+        sink_file.close()
+        sink_file = None
+
+
+def span(phase: str, name: str = '', total_bytes: Optional[int] = None, total_count: Optional[int] = None) -> Span:
+    """Start timing `phase` of `name`. Use as `with span(...) as s: s.add(...)`."""
+    return Span(phase, name, total_bytes, total_count, sink)
+
+
+atexit.register(close)
+configure(os.environ.get('MINI_BC_METRICS'))
@@ -1,57 +1,97 @@
 """Combine the functions of extract and decrypt"""
 
-import zipfile
+import contextlib
 import os
 import sys
-import io
 import re
-from download import CountryCode
-from decrypt import decryptfile
+import metrics
+from apkfile import open_inner_apk
+from core import CountryCode, pop_option
+from decrypt import PACK_MEMORY_BUDGET, PackJob, Store, decrypt_packs, verify_packs, VersionOutput
 
-INNER_APK = 'InstallPack.apk'
 INNER_FOLDER = 'assets/'
 
 ual = '--use-all-langs'
-if len(sys.argv) < 2:
-    print(f'Usage: python simpleapk.py <to_read> [<{ual}>?]')
-
-apk_to_read = os.path.expanduser(sys.argv[1])
-
-files = {}
-with zipfile.ZipFile(apk_to_read) as outer:
-    inner = io.BytesIO(outer.read(INNER_APK))
-    with zipfile.ZipFile(inner) as apk:
-        for fileinfo in apk.infolist():
-            if not re.match(r'^assets/\w+\.(?:list|pack)$', fileinfo.filename):
-                continue
-            newname = os.path.basename(fileinfo.filename)
-
-            with apk.open(fileinfo) as fd:
-                content = fd.read()
-                files[newname] = content
-
-names = []
-for fname in files:
-    name, ext = os.path.splitext(fname)
-    if ext == '.pack':
-        names.append(name)
-names.sort()
-
-if ual not in sys.argv:
-    names2 = list(filter(lambda x: '_' not in x, names))
-    if names2 != names:
-        print(f'Removing all variant languages because {ual} is not set')
-        names = names2
+args = sys.argv[1:]
+metrics.configure(pop_option(args, '--metrics'))
+jobs = int(pop_option(args, '--jobs', '1'))  # type: ignore
+packs = int(pop_option(args, '--packs', '1'))  # type: ignore
+memory_budget = int(pop_option(args, '--memory-budget', str(PACK_MEMORY_BUDGET >> 20))) << 20  # type: ignore
+previous = pop_option(args, '--previous')
+archive = '--archive' in args
+if archive:
+    args.remove('--archive')
+store = Store() if '--store' in args else None
+if store is not None:
+    args.remove('--store')
+verify = '--verify' in args
+if verify:
+    args.remove('--verify')
+resume = '--force' not in args
+if not resume:
+    args.remove('--force')
+if len(args) < 1:
+    print(f'Usage: python simpleapk.py <to_read> [<{ual}>?] [--jobs <n>] [--packs <n>] [--memory-budget <MiB>] [--previous <e.g. en-14.7>] [--archive | --store] [--force | --verify]')
+
+apk_to_read = os.path.expanduser(args[0])
 
 extracted_name = os.path.basename(apk_to_read.rstrip('.apk'))
 output_dir = os.path.join('./data/decrypted', extracted_name)
 [lang, *_] = extracted_name.partition('-')
 cc = CountryCode.from_cc(lang)
 
-for name in names:
-    list_data = bytes(files[f'{name}.list'])
-    pack_data = bytes(files[f'{name}.pack'])
+if verify:
+    version_output = VersionOutput.open(extracted_name, archive, store)
+    previous_output = None
+else:
+    version_output = VersionOutput(extracted_name, archive, store=store)
+    previous_output = VersionOutput.find(previous) if previous is not None else None
+
+# packs are only read when they are about to be decrypted, so only those
+# being decrypted are ever in memory
+with open_inner_apk(apk_to_read) as apk:
+    files = {}
+    for fileinfo in apk.zip.infolist():
+        if not re.match(r'^assets/\w+\.(?:list|pack)$', fileinfo.filename):
+            continue
+        newname = os.path.basename(fileinfo.filename)
+        files[newname] = fileinfo
+
+    names = []
+    for fname in files:
+        name, ext = os.path.splitext(fname)
+        if ext == '.pack':
+            names.append(name)
+    names.sort()
+
+    if ual not in args:
+        names2 = list(filter(lambda x: '_' not in x, names))
+        if names2 != names:
+            print(f'Removing all variant languages because {ual} is not set')
+            names = names2
+
+    def opener(name: str):
+        @contextlib.contextmanager
+        def open_pack():
+            with apk.member(files[f'{name}.list']) as list_view:
+                list_data = bytes(list_view)
+            with apk.member(files[f'{name}.pack']) as pack_data:
+                yield list_data, pack_data
+
+        return open_pack
+
+    if verify:
+        lists = {}
+        for name in names:
+            with apk.member(files[f'{name}.list']) as list_view:
+                lists[name] = bytes(list_view)
+        intact = verify_packs(lists, version_output, jobs)
+        version_output.close()
+        sys.exit(0 if intact else 1)
 
-    targ_base_path = os.path.join('./data/decrypted', extracted_name, name)
+    pack_jobs = [PackJob(name, files[f'{name}.pack'].file_size, opener(name)) for name in names]
+    decrypt_packs(pack_jobs, cc, version_output, previous_output, packs, jobs, memory_budget, resume)
 
-    decryptfile(list_data, pack_data, name, cc, targ_base_path)
+version_output.close()
+if previous_output is not None:
+    previous_output.close()
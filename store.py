@@ -0,0 +1,36 @@
+"""Manage the deduplicated store that `--store` decrypts into"""
+
+import os
+import sys
+from decrypt import DECRYPTED_DIR, STORE_DIR, Store
+from core import pop_option
+from metrics import FileSize
+
+USAGE = """Usage:
+  python store.py materialize <version> [<dest>] [--store-dir <dir>]
+      hardlink the files of e.g. en-15.0 into <dest>, ./data/decrypted/en-15.0 by default
+  python store.py gc [--store-dir <dir>]
+      delete blobs no version uses any more
+  python store.py list [--store-dir <dir>]
+      list the versions in the store"""
+
+args = sys.argv[1:]
+store = Store(pop_option(args, '--store-dir', STORE_DIR))  # type: ignore
+command = args[0] if args else None
+
+if command == 'materialize' and len(args) >= 2:
+    version = args[1]
+    if version not in store.versions():
+        print(f'{version} is not in {store.path}')
+        sys.exit(1)
+    dest = args[2] if len(args) >= 3 else os.path.join(DECRYPTED_DIR, version)
+    count = store.materialize(version, dest)
+    print(f'Linked {count} files to {dest}')
+elif command == 'gc':
+    removed, size = store.gc()
+    print(f'Removed {removed} unused blobs, {FileSize(size)}')
+elif command == 'list':
+    for version in store.versions():
+        print(version)
+else:
+    print(USAGE)
@@ -0,0 +1,41 @@
+import io
+import os
+import zipfile
+import pytest
+import apkfile
+from apkfile import open_inner_apk
+
+MEMBERS = {
+    'assets/stored.pack': (zipfile.ZIP_STORED, os.urandom(5000)),
+    'assets/small.list': (zipfile.ZIP_DEFLATED, b'small,0,5\n' * 10),
+    'assets/big.pack': (zipfile.ZIP_DEFLATED, os.urandom(3000) * 20),
+    'assets/empty.list': (zipfile.ZIP_DEFLATED, b''),
+}
+
+
+def make_xapk(path: str, compress_type: int):
+    inner = io.BytesIO()
+    with zipfile.ZipFile(inner, 'w') as z:
+        for name, (member_compress_type, data) in MEMBERS.items():
+            z.writestr(name, data, member_compress_type)
+    with zipfile.ZipFile(path, 'w') as outer:
+        outer.writestr('manifest.json', b'{}')
+        outer.writestr('InstallPack.apk', inner.getvalue(), compress_type)
+
+
+@pytest.mark.parametrize('compress_type', [zipfile.ZIP_STORED, zipfile.ZIP_DEFLATED])
+def test_members(tmp_path, monkeypatch, compress_type):
+    # big.pack is deflated and bigger than this, so it is spilled to a file
+    monkeypatch.setattr(apkfile, 'SPILL_SIZE', 10_000)
+    path = str(tmp_path / 'test.xapk')
+    make_xapk(path, compress_type)
+
+    with open_inner_apk(path) as inner:
+        for name, (_, data) in MEMBERS.items():
+            info = inner.zip.getinfo(name)
+            with inner.member(info) as content:
+                assert bytes(content) == data
+                # mapped unless it is small enough to read into memory
+                assert isinstance(content, memoryview) == (name in ('assets/stored.pack', 'assets/big.pack'))
+            inner.extract(info, str(tmp_path / 'out'))
+            assert (tmp_path / 'out').read_bytes() == data
@@ -0,0 +1,61 @@
+import http.server
+import threading
+from typing import Any
+import pytest
+import asynchttp
+from asynchttp import AsyncClient
+
+
+class Handler(http.server.BaseHTTPRequestHandler):
+    """`/flaky` fails with a 503 twice before it works, anything else echoes its path."""
+
+    requests: list[str] = []
+
+    def log_message(self, *_: Any):
+        pass
+
+    def do_GET(self):
+        self.requests.append(self.path)
+        if self.path.endswith('/flaky') and self.requests.count(self.path) <= 2:
+            self.send_response(503)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        body = self.path.encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+@pytest.fixture
+def server():
+    handler = type('Handler', (Handler,), {'requests': []})
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield server
+    server.shutdown()
+
+
+async def get_text(client: AsyncClient, url: str) -> tuple[int, str]:
+    async with await client.get(url) as res:
+        return res.status, await res.text()
+
+
+def test_retries_server_errors(server):
+    url = f'http://127.0.0.1:{server.server_port}/flaky'
+    assert asynchttp.run(get_text(AsyncClient(backoff=0.01), url)) == (200, '/flaky')
+    assert server.RequestHandlerClass.requests == ['/flaky'] * 3
+
+
+def test_gives_up_after_retries(server):
+    url = f'http://127.0.0.1:{server.server_port}/flaky'
+    assert asynchttp.run(get_text(AsyncClient(retries=1, backoff=0.01), url)) == (503, '')
+
+
+def test_uses_proxy_from_environment(server, monkeypatch):
+    for name in ('NO_PROXY', 'no_proxy'):
+        monkeypatch.delenv(name, raising=False)
+    monkeypatch.setenv('HTTP_PROXY', f'http://127.0.0.1:{server.server_port}')
+    status, text = asynchttp.run(get_text(AsyncClient(), 'http://uptodown.invalid/versions'))
+    assert (status, text) == (200, 'http://uptodown.invalid/versions')
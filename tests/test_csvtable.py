@@ -0,0 +1,37 @@
+import pytest
+from csvtable import Table, iter_csv_rows, load_table
+from decrypt import parse_csv_file
+
+TEXT = 'id,name,cost\r\n1,a\x0cb,10\n\n2,c d\x1ce,20\n3,,\x85,30\n'
+
+
+@pytest.fixture
+def csv_path(tmp_path):
+    path = tmp_path / 'unit.csv'
+    path.write_bytes(TEXT.encode('utf-8'))
+    return str(path)
+
+
+def stripped(rows: list[list[str]]) -> list[list[str]]:
+    # a table has no line endings and skips blank lines
+    return [row[:-1] + [row[-1].rstrip('\n')] for row in rows if row not in (['\n'], [])]
+
+
+@pytest.mark.parametrize('blacklist', [None, ['']])
+def test_table_matches_rows(csv_path, tmp_path, blacklist):
+    table = load_table(csv_path, blacklist=blacklist, cache_dir=str(tmp_path / 'cache'))
+    cached = load_table(csv_path, blacklist=blacklist, cache_dir=str(tmp_path / 'cache'))
+    rows = stripped(parse_csv_file(csv_path, blacklist=blacklist))
+    assert [list(map(str, row)) for row in table] == rows
+    assert [list(map(str, row)) for row in cached] == rows
+    assert len(table) == 4
+
+
+def test_blacklist_drops_whole_fields():
+    rows = list(iter_csv_rows(lines=['1,-,x-y,-\n'], blacklist=['-']))
+    assert rows == [['1', 'x-y']]
+
+
+def test_numeric_columns():
+    table = Table.parse('1,2\n3,4\n')
+    assert table.is_numeric(0) and list(table.column(1)) == [2, 4]
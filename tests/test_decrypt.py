@@ -0,0 +1,202 @@
+from __future__ import annotations
+
+import os
+import shutil
+import pytest
+import decrypt
+from bench import CC, PACKS, VERSION, make_assets
+from decrypt import DirOutput, PackReader, Store, VersionOutput, decrypt_packs, dir_pack_jobs, open_file_b, verify_pack, verify_packs
+from listindex import ListIndex
+
+
+@pytest.fixture
+def assets(tmp_path):
+    make_assets(str(tmp_path / VERSION), 200_000)
+    return str(tmp_path / VERSION / 'assets')
+
+
+def run(
+    assets: str,
+    base_dir: str,
+    archive: bool = False,
+    workers: int = 1,
+    jobs: int = 1,
+    resume: bool = True,
+    previous: VersionOutput | None = None,
+    store: Store | None = None,
+    version: str = VERSION,
+):
+    version_output = VersionOutput(version, archive, base_dir, store)
+    try:
+        decrypt_packs(
+            dir_pack_jobs(assets, sorted(PACKS)), CC, version_output, previous, workers=workers, jobs=jobs, resume=resume
+        )
+    finally:
+        version_output.close()
+
+
+def lists(assets: str) -> dict[str, bytes]:
+    return {name: open_file_b(os.path.join(assets, f'{name}.list')) for name in sorted(PACKS)}
+
+
+def verify(assets: str, base_dir: str) -> bool:
+    version_output = VersionOutput.find(VERSION, base_dir)
+    try:
+        return verify_packs(lists(assets), version_output)
+    finally:
+        version_output.close()
+
+
+@pytest.mark.parametrize('jobs', [1, 4])
+def test_write_error_is_not_hidden(assets, tmp_path, monkeypatch, jobs):
+    def failing_write(self, name, data):
+        raise OSError('disk full')
+
+    monkeypatch.setattr(decrypt.DirOutput, 'write', failing_write)
+    with pytest.raises(OSError, match='disk full'):
+        run(assets, str(tmp_path / 'decrypted'), jobs=jobs)
+
+
+def test_archive_drops_unfinished_pack(assets, tmp_path, monkeypatch):
+    base_dir = str(tmp_path / 'decrypted')
+    run(assets, base_dir, archive=True)
+
+    writes = 0
+    write = decrypt.Archive.write
+
+    def failing_write(self, pack, name, data):
+        nonlocal writes
+        writes += 1
+        if writes > 3:
+            raise OSError('disk full')
+        write(self, pack, name, data)
+
+    monkeypatch.setattr(decrypt.Archive, 'write', failing_write)
+    with pytest.raises(OSError):
+        run(assets, base_dir, archive=True, resume=False)
+    monkeypatch.undo()
+    # the pack that failed still has its files from the first run
+    assert verify(assets, base_dir)
+
+
+def test_archive_with_several_workers(assets, tmp_path):
+    base_dir = str(tmp_path / 'decrypted')
+    run(assets, base_dir, archive=True, workers=4)
+    assert verify(assets, base_dir)
+
+
+def test_verify_then_resume(assets, tmp_path, capsys):
+    base_dir = str(tmp_path / 'decrypted')
+    run(assets, base_dir)
+    folder = os.path.join(base_dir, VERSION, 'DataLocal')
+    names = sorted(os.listdir(folder))
+    os.remove(os.path.join(folder, names[0]))
+    with open(os.path.join(folder, names[1]), 'r+b') as f:
+        f.write(b'corrupt')
+
+    check = verify_pack(lists(assets)['DataLocal'], DirOutput(folder))
+    assert (check.ok, check.missing, check.corrupt) == (len(names) - 2, [names[0]], [names[1]])
+    capsys.readouterr()
+    assert not verify(assets, base_dir)
+    assert '1 missing and 1 corrupt files' in capsys.readouterr().out
+
+    run(assets, base_dir)
+    assert f'kept {len(names) - 2}/{len(names)} files' in capsys.readouterr().out
+    assert verify(assets, base_dir)
+
+
+def test_archive_resume_drops_removed_files(assets, tmp_path):
+    base_dir = str(tmp_path / 'decrypted')
+    run(assets, base_dir, archive=True)
+    # the same packs with fewer entries, like a version that removed some
+    make_assets(os.path.dirname(assets), 100_000)
+    run(assets, base_dir, archive=True)
+
+    version_output = VersionOutput.find(VERSION, base_dir)
+    try:
+        for name, list_data in lists(assets).items():
+            index = ListIndex.parse(decrypt.unpack_list(list_data).decode('utf-8'))
+            assert version_output.archive.names(name) == sorted(index.names)
+    finally:
+        version_output.close()
+    assert verify(assets, base_dir)
+
+
+def test_old_previous_manifest_with_unreadable_copy(assets, tmp_path, monkeypatch):
+    old_dir = str(tmp_path / 'old')
+    run(assets, old_dir)
+    # manifests from before sizes and content hashes were added
+    for name in PACKS:
+        path = os.path.join(old_dir, VERSION, f'{name}.manifest')
+        rows = decrypt.read_rows(path)
+        with open(path, 'w', encoding='utf-8') as f:
+            f.writelines(','.join(row[:4]) + '\n' for row in rows)
+
+    monkeypatch.setattr(DirOutput, 'read', lambda self, name: None)
+    base_dir = str(tmp_path / 'decrypted')
+    previous = VersionOutput(VERSION, False, old_dir)
+    run(assets, base_dir, previous=previous)
+    monkeypatch.undo()
+    assert verify(assets, base_dir)
+
+
+def test_pack_reader_cache_budget(assets, tmp_path):
+    base_dir = str(tmp_path / 'decrypted')
+    run(assets, base_dir)
+    folder = os.path.join(base_dir, VERSION, 'DataLocal')
+
+    with PackReader.open(os.path.dirname(assets), 'DataLocal', CC, cache_size=30_000) as reader:
+        names = reader.names()
+        for name in names:
+            assert reader.read(name) == open_file_b(os.path.join(folder, name))
+            assert reader.cached == sum(map(len, reader.cache.values())) <= 30_000
+        # the most recently read are kept, oldest first
+        cached = list(reader.cache)
+        assert cached == names[len(names) - len(cached) :]
+        reader.read(cached[0])
+        assert list(reader.cache)[-1] == cached[0]
+
+    with PackReader.open(os.path.dirname(assets), 'DataLocal', CC, cache_size=100) as reader:
+        reader.read(reader.names()[0])
+        assert not reader.cache
+
+
+def test_store_gc_and_materialize(assets, tmp_path):
+    store = Store(str(tmp_path / 'store'))
+    run(assets, str(tmp_path / 'decrypted'), store=store)
+    kept = {content_hash for pack in store.packs(VERSION) for content_hash in store.objects(VERSION, pack).values()}
+    make_assets(os.path.dirname(assets), 400_000)
+    run(assets, str(tmp_path / 'decrypted'), store=store, version='en-98.0')
+    # what an interrupted write leaves behind
+    leftover = store.blob_path(next(iter(kept))) + '.1-1.tmp'
+    open(leftover, 'wb').close()
+
+    shutil.rmtree(store.version_path('en-98.0'))
+    removed, size = store.gc()
+    assert removed > 1 and size > 0
+    objects = os.path.join(store.path, 'objects')
+    assert {prefix + name for prefix in os.listdir(objects) for name in os.listdir(os.path.join(objects, prefix))} == kept
+
+    make_assets(os.path.dirname(assets), 200_000)
+    dest = str(tmp_path / 'decrypted' / VERSION)
+    assert store.materialize(VERSION, dest) == sum(len(store.objects(VERSION, pack)) for pack in PACKS)
+    assert verify(assets, str(tmp_path / 'decrypted'))
+
+
+@pytest.mark.parametrize('form', ['archive', 'store'])
+def test_verify_asked_for_output(assets, tmp_path, form):
+    base_dir = str(tmp_path / 'decrypted')
+    store = Store(str(tmp_path / 'store')) if form == 'store' else None
+    run(assets, base_dir, archive=form == 'archive', store=store)
+    # a folder left over from an older decrypt, which find would pick
+    stale = os.path.join(base_dir, VERSION, 'DataLocal')
+    os.makedirs(stale)
+    with open(os.path.join(stale, '000000.csv'), 'wb') as f:
+        f.write(b'stale')
+    assert not verify(assets, base_dir)
+
+    version_output = VersionOutput.open(VERSION, form == 'archive', store, base_dir)
+    try:
+        assert verify_packs(lists(assets), version_output)
+    finally:
+        version_output.close()
@@ -0,0 +1,209 @@
+import http.server
+import json
+import os
+import threading
+import pytest
+import asynchttp
+import download as dl
+from bench import CC, PAGES_DIR, FileHandler, serve_file
+from download import download_ranged, fetch_range, get_client
+
+
+@pytest.fixture
+def served(tmp_path):
+    path = tmp_path / 'served.apk'
+    path.write_bytes(os.urandom(300_001))
+    return path
+
+
+def download(url: str, tmp_path, ranges: int) -> str:
+    abs_path = str(tmp_path / 'out' / 'download.apk')
+    download_ranged(url, abs_path, ranges=ranges)
+    return abs_path
+
+
+def parts(abs_path: str) -> list[str]:
+    folder = os.path.dirname(abs_path)
+    return sorted(name for name in os.listdir(folder) if '.part' in name)
+
+
+@pytest.mark.parametrize('ranges', [1, 4])
+def test_ranged(served, tmp_path, ranges):
+    server, url = serve_file(str(served))
+    try:
+        abs_path = download(url, tmp_path, ranges)
+    finally:
+        server.shutdown()
+    assert open(abs_path, 'rb').read() == served.read_bytes()
+    assert parts(abs_path) == []
+
+
+def test_range_rejected(served, tmp_path):
+    server, url = serve_file(str(served), ranges=False)
+    try:
+        abs_path = download(url, tmp_path, 4)
+    finally:
+        server.shutdown()
+    assert open(abs_path, 'rb').read() == served.read_bytes()
+    assert parts(abs_path) == []
+
+
+def test_resume_with_fewer_ranges(served, tmp_path):
+    data = served.read_bytes()
+    size = len(data)
+    abs_path = str(tmp_path / 'out' / 'download.apk')
+    os.makedirs(os.path.dirname(abs_path))
+    # what an interrupted run with 4 ranges leaves behind
+    for i in range(4):
+        start = size * i // 4
+        with open(abs_path + '.part' + (str(start) if start else ''), 'wb') as f:
+            f.write(data[start : start + 1000])
+
+    server, url = serve_file(str(served))
+    try:
+        download(url, tmp_path, 2)
+    finally:
+        server.shutdown()
+    assert open(abs_path, 'rb').read() == data
+    assert parts(abs_path) == []
+
+
+class DroppingHandler(FileHandler):
+    """Like `FileHandler`, but the first response stops halfway through."""
+
+    dropped = False
+
+    def do_GET(self):
+        if type(self).dropped:
+            return super().do_GET()
+        type(self).dropped = True
+        data = open(self.path_to_serve, 'rb').read()
+        self.send_response(200)
+        self.send_header('Accept-Ranges', 'bytes')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data[: len(data) // 2])
+        self.close_connection = True
+
+
+def test_resume_after_drop(served, tmp_path):
+    handler = type('Handler', (DroppingHandler,), {'path_to_serve': str(served)})
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        abs_path = download(f'http://127.0.0.1:{server.server_port}/served.apk', tmp_path, 1)
+    finally:
+        server.shutdown()
+    assert handler.dropped
+    assert open(abs_path, 'rb').read() == served.read_bytes()
+
+
+def test_disk_error_not_retried(served, tmp_path):
+    requests = []
+
+    class CountingHandler(FileHandler):
+        path_to_serve = str(served)
+
+        def do_GET(self):
+            requests.append(self.headers.get('Range'))
+            super().do_GET()
+
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), CountingHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f'http://127.0.0.1:{server.server_port}/served.apk'
+    # a folder that doesn't exist can't be written to
+    path = str(tmp_path / 'missing' / 'download.apk.part')
+    try:
+        with pytest.raises(FileNotFoundError):
+            asynchttp.run(fetch_range(get_client(), url, path, 1000, 2000, lambda n: None))
+    finally:
+        server.shutdown()
+    assert requests == ['bytes=1000-1999']
+
+
+class UptodownHandler(http.server.BaseHTTPRequestHandler):
+    """The parts of uptodown that finding a download url reads."""
+
+    pages: list[str] = []
+
+    def log_message(self, *_):
+        pass
+
+    def do_GET(self):
+        type(self).pages.append(self.path)
+        base = f'http://127.0.0.1:{self.server.server_port}'
+        if self.path == '/android/versions':
+            body = open(os.path.join(PAGES_DIR, 'uptodown-versions.html'), 'rb').read()
+        elif self.path.startswith('/android/apps/1234567/versions/'):
+            versions = [
+                {'fileID': i, 'version': f'15.0.{i}', 'versionURL': {'url': base, 'extraURL': 'download', 'versionID': i}}
+                for i in range(8)
+            ]
+            body = json.dumps({'data': versions if self.path.endswith('/0') else []}).encode()
+        else:
+            body = open(os.path.join(PAGES_DIR, 'uptodown-download.html'), 'rb').read()
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def test_concurrent_uptodown_lookups(tmp_path, monkeypatch):
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), UptodownHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    monkeypatch.setattr(dl, 'UPTODOWN_URL', f'http://127.0.0.1:{server.server_port}')
+    monkeypatch.setattr(dl, 'CACHE_DIR', str(tmp_path))
+    monkeypatch.setattr(dl, 'client', None)
+    monkeypatch.setattr(dl, 'index_lock', None)
+    monkeypatch.setattr(dl, 'uptodown_indexes', {})
+    # fewer worker threads than lookups, which used to hold all of them
+    # while waiting on each other
+    monkeypatch.setattr(asynchttp, 'loop', None)
+    monkeypatch.setattr(asynchttp, 'WORKERS', 2)
+    UptodownHandler.pages = []
+
+    urls: list[str] = []
+
+    def lookup(version: str):
+        urls.append(dl.get_uptodown_download_url(version, CC))
+
+    threads = [threading.Thread(target=lookup, args=(f'15.0.{i}',), daemon=True) for i in range(8)]
+    try:
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(timeout=30)
+        assert urls == [dl.UPTODOWN_DOWNLOAD_URL + 'ZHdsL2JhdHRsZS1jYXRzLzE1LjAuMS9hcGs'] * 8
+    finally:
+        asynchttp.loop.call_soon_threadsafe(asynchttp.loop.stop)
+        server.shutdown()
+    # one lookup of the versions, shared by all of them
+    assert UptodownHandler.pages.count('/android/versions') == 1
+    assert sorted(page for page in UptodownHandler.pages if '/versions/' in page) == [
+        f'/android/apps/1234567/versions/{i}' for i in range(dl.UPTODOWN_JOBS)
+    ]
+
+
+def test_uptodown_index_needs_app_id(tmp_path, monkeypatch):
+    async def no_app_id(country_code):
+        return None
+
+    monkeypatch.setattr(dl, 'CACHE_DIR', str(tmp_path))
+    monkeypatch.setattr(dl, 'uptodown_indexes', {})
+    monkeypatch.setattr(dl, 'get_uptodown_app_id_async', no_app_id)
+    with pytest.raises(ValueError, match='no app id'):
+        dl.get_uptodown_version_index(CC)
+    assert os.listdir(tmp_path) == []
+
+
+def test_version_index():
+    index = dl.VersionIndex((v, i) for i, v in enumerate(['14.1.0', '13.0', '14.0.1', '14.1', '9.9.1', '13.10.0']))
+    assert [v for v, _ in index] == ['9.9.1', '13.0', '13.10.0', '14.0.1', '14.1', '14.1.0']
+    # the first listing of 14.1 counts as the newest
+    assert index.latest('14') == 0
+    assert index.latest('13.1') is None
+    assert index.latest('13.10') == 5
+    assert index.prefix_range('13') == (1, 3)
+    assert index.between('13.0', '14.0') == [('13.0', 1), ('13.10.0', 5), ('14.0.1', 2)]
+    assert index.between('14') == [('14.0.1', 2), ('14.1', 3), ('14.1.0', 0)]
+    assert index.between(end='9') == [('9.9.1', 4)]
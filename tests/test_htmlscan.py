@@ -0,0 +1,47 @@
+import asyncio
+import os
+import pytest
+import htmlscan
+from bench import PAGES_DIR, make_apkpure_page, page_extractors
+
+
+def read_page(name: str) -> str:
+    with open(os.path.join(PAGES_DIR, name), encoding='utf-8') as f:
+        return f.read()
+
+
+@pytest.mark.parametrize('name', sorted(os.listdir(PAGES_DIR)))
+def test_same_as_legacy(name):
+    before, after = page_extractors(read_page(name))
+    assert after() == before()
+
+
+def test_apkpure_versions():
+    parser = htmlscan.parse_page(htmlscan.ApkpureVersions(), read_page('apkpure-versions.html'))
+    assert parser.versions[:3] == ['15.0.1', '15.0.0', '14.7.1']
+    assert len(parser.versions) == 16
+    assert parser.title.startswith('Old Versions of The Battle Cats')
+
+
+def test_apkpure_unclosed_items():
+    parser = htmlscan.parse_page(htmlscan.ApkpureVersions(), make_apkpure_page(20, filler=5, close_items=False))
+    assert parser.versions == [f'0.{i}.0' for i in range(20)]
+
+
+def test_uptodown_attributes():
+    app = htmlscan.parse_page(htmlscan.AttributeAfter('detail-app-name', 'data-code'), read_page('uptodown-versions.html'))
+    assert app.value == '1234567'
+    button = htmlscan.AttributeAfter('detail-download-button', 'data-url')
+    assert htmlscan.parse_page(button, read_page('uptodown-download.html')).value == 'ZHdsL2JhdHRsZS1jYXRzLzE1LjAuMS9hcGs'
+
+
+def test_parse_chunks_splits_anywhere():
+    data = read_page('apkpure-versions.html').encode('utf-8')
+
+    async def chunks():
+        for i in range(0, len(data), 7):
+            yield data[i : i + 7]
+
+    parser = htmlscan.ApkpureVersions()
+    assert asyncio.run(htmlscan.parse_chunks(parser, chunks())) == len(data)
+    assert parser.versions == htmlscan.parse_page(htmlscan.ApkpureVersions(), data.decode('utf-8')).versions
@@ -0,0 +1,49 @@
+import pytest
+from listindex import ListIndex, read_index, write_index
+
+LIST = '3\na.csv,0,10\nb.png,10,0\nc.csv,16,16\n'
+
+
+def test_parse_and_find():
+    index = ListIndex.parse(LIST)
+    assert list(index) == [('a.csv', 0, 10), ('b.png', 10, 0), ('c.csv', 16, 16)]
+    assert index.find('c.csv') == (16, 16)
+    assert 'b.png' in index and 'd.csv' not in index
+    with pytest.raises(KeyError):
+        index.find('d.csv')
+    index.validate(32)
+
+
+def test_parse_bad_number():
+    with pytest.raises(ValueError, match=r"b.png: 'x' is not a valid offset or length"):
+        ListIndex.parse('2\na.csv,0,10\nb.png,x,0\n')
+
+
+@pytest.mark.parametrize(
+    'list_data, message',
+    [
+        ('2\na.csv,0,10\nb.csv,8,8\n', 'b.csv overlaps a.csv'),
+        ('2\na.csv,0,10\na.csv,16,16\n', 'a.csv is listed more than once'),
+        ('1\na.csv,24,16\n', r'a.csv: 16 bytes at 24 is outside of the pack \(32 bytes\)'),
+        ('1\na.csv,-16,16\n', 'outside of the pack'),
+    ],
+)
+def test_validate_rejects(list_data, message):
+    with pytest.raises(ValueError, match=message):
+        ListIndex.parse(list_data).validate(32)
+
+
+def test_roundtrip(tmp_path):
+    index = ListIndex.parse(LIST)
+    assert list(ListIndex.from_bytes(index.to_bytes())) == list(index)
+    assert len(ListIndex.from_bytes(ListIndex.parse('0\n').to_bytes())) == 0
+
+    base = str(tmp_path / 'DataLocal')
+    assert read_index(base) is None
+    write_index(base, index)
+    assert list(read_index(base)) == list(index)
+
+    with pytest.raises(ValueError, match='truncated'):
+        ListIndex.from_bytes(index.to_bytes()[:-6])
+    with pytest.raises(ValueError, match='not a list index'):
+        ListIndex.from_bytes(b'PNG\0' + index.to_bytes()[4:])
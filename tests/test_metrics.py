@@ -0,0 +1,36 @@
+import io
+import json
+import metrics
+
+
+def test_json_file_closed_when_replaced(tmp_path):
+    path = tmp_path / 'metrics.jsonl'
+    metrics.configure(f'json:{path}')
+    stream = metrics.sink_file
+    with metrics.span('write', 'DataLocal') as span:
+        span.add(bytes=10, count=1)
+    metrics.configure('quiet')
+
+    assert stream is not None and stream.closed
+    assert metrics.sink_file is None
+    [line] = path.read_text().splitlines()
+    assert json.loads(line)['bytes'] == 10
+
+
+class Terminal(io.StringIO):
+    checks = 0
+
+    def isatty(self) -> bool:
+        self.checks += 1
+        return True
+
+
+def test_bar_checks_terminal_once():
+    stream = Terminal()
+    sink = metrics.BarSink(stream, interval=0)
+    with metrics.Span('download', 'test.apk', 100, None, sink) as span:
+        for _ in range(10):
+            span.add(bytes=10)
+
+    assert stream.checks == 1
+    assert stream.getvalue().endswith('100% (100 B/100 B)    \n')
@@ -0,0 +1,95 @@
+import os
+import pytest
+from bench import CC, PACKS, VERSION, make_apk, make_assets, make_pack
+from core import CountryCode
+from decrypt import VersionOutput, decrypt_packs, dir_pack_jobs
+from versionfs import VersionFS, diff_versions, match_parts
+
+
+@pytest.fixture
+def extracted(tmp_path):
+    folder = str(tmp_path / 'extracted' / VERSION)
+    make_assets(folder, 200_000)
+    return folder
+
+
+@pytest.mark.parametrize(
+    'pattern, parts, matches',
+    [
+        ('**/*.csv', ('DataLocal', 'a.csv'), True),
+        ('**/*.csv', ('a.csv',), True),
+        ('**', (), True),
+        ('Data*/**/a.csv', ('DataLocal', 'a.csv'), True),
+        ('*/a.csv', ('DataLocal', 'x', 'a.csv'), False),
+        ('**/x/*.csv', ('DataLocal', 'a.csv'), False),
+    ],
+)
+def test_match_parts(pattern, parts, matches):
+    assert match_parts(tuple(pattern.split('/')), parts) == matches
+
+
+@pytest.mark.parametrize('source', ['extracted', 'apk'])
+def test_read_and_glob(extracted, tmp_path, source):
+    base_dir = str(tmp_path / 'decrypted')
+    version_output = VersionOutput(VERSION, False, base_dir)
+    try:
+        decrypt_packs(dir_pack_jobs(os.path.join(extracted, 'assets'), sorted(PACKS)), CC, version_output)
+    finally:
+        version_output.close()
+    if source == 'apk':
+        make_apk(str(tmp_path / f'{VERSION}.apk'), extracted)
+        path = str(tmp_path / f'{VERSION}.apk')
+    else:
+        path = extracted
+
+    with VersionFS(path) as fs:
+        assert fs.name == VERSION and fs.packs() == sorted(PACKS)
+        files = [p for p in fs.root.walk() if p.is_file()]
+        assert len(files) > len(PACKS)
+        assert sorted(fs.root.glob('**/*.csv')) == sorted(fs.root.rglob('*.csv')) == sorted(files)
+        assert sorted(fs.root.glob('*')) == [fs / pack for pack in sorted(PACKS)]
+        assert sorted(fs.root.glob('Data*/00000?.csv')) == sorted((fs / 'DataLocal').glob('00000?.csv'))
+        assert [str(p) for p in fs.root.glob('Data*/000001.csv')] == [f'{VERSION}/DataLocal/000001.csv']
+        for p in files:
+            assert p.read_bytes() == open(os.path.join(base_dir, VERSION, *p.parts), 'rb').read()
+        assert not (fs / 'DataLocal' / 'missing.csv').exists()
+        with pytest.raises(FileNotFoundError):
+            (fs / 'Missing' / '000001.csv').read_bytes()
+
+
+def test_diff_versions(extracted, tmp_path):
+    new = str(tmp_path / 'extracted' / 'en-99.1')
+    # fewer entries in every pack, a changed DataLocal and no Server_Bench
+    make_assets(new, 100_000)
+    list_raw, pack_raw = make_pack('DataLocal', CC, 300_000, PACKS['DataLocal'][1], seed=99)
+    with open(os.path.join(new, 'assets', 'DataLocal.list'), 'wb') as f:
+        f.write(list_raw)
+    with open(os.path.join(new, 'assets', 'DataLocal.pack'), 'wb') as f:
+        f.write(pack_raw)
+    for ext in ('list', 'pack'):
+        os.remove(os.path.join(new, 'assets', f'Server_Bench.{ext}'))
+
+    with VersionFS(extracted) as old_fs, VersionFS(new) as new_fs:
+        diffs = diff_versions(old_fs, new_fs, jobs=2)
+        assert list(diffs) == sorted(PACKS)
+        for pack, diff in diffs.items():
+            old_names = old_fs.reader(pack).names()
+            new_names = new_fs.reader(pack).names() if pack in new_fs.pack_names else []
+            assert diff.added == [name for name in new_names if name not in old_names]
+            assert diff.removed == [name for name in old_names if name not in new_names]
+            assert diff.modified == [
+                name
+                for name in new_names
+                if name in old_names and old_fs.reader(pack).read(name) != new_fs.reader(pack).read(name)
+            ]
+        assert diffs['DataLocal'].added and diffs['DataLocal'].modified
+        assert diffs['resLocal'].removed and not diffs['resLocal'].modified
+        assert diffs['Server_Bench'].removed == old_fs.reader('Server_Bench').names()
+
+
+def test_diff_versions_with_other_keys(extracted, tmp_path):
+    # the same files encrypted for another country are compared decrypted
+    other = str(tmp_path / 'extracted' / 'jp-99.0')
+    make_assets(other, 200_000, CountryCode.JP)
+    with VersionFS(extracted) as old_fs, VersionFS(other) as new_fs:
+        assert not any(diff_versions(old_fs, new_fs).values())
@@ -0,0 +1,300 @@
+"""
+Read-only view of every pack of a version as a tree of paths, e.g.
+`VersionFS.find('en-15.0') / 'DataLocal' / 'stage.csv'`, with files only
+decrypted when they are read. Nothing is written to disk.
+"""
+
+from __future__ import annotations
+
+import contextlib
+import fnmatch
+import io
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import IO, Iterator, NamedTuple, Optional
+import metrics
+from apkfile import open_inner_apk
+from decrypt import PackReader, map_file, open_file_b, version_cc
+from core import CountryCode
+
+EXTRACTED_DIR = './data/extracted'
+APK_DIR = './data/apk'
+
+
+class VersionFS:
+    """
+    The packs in `source`, either an extracted folder such as
+    ./data/extracted/en-15.0 or an apk such as ./data/apk/en-15.0.apk. Each
+    pack's list is decrypted the first time something in it is looked at and
+    read through a `PackReader`, sharing `cache_size` bytes of cache per pack.
+    """
+
+    def __init__(self, source: str, cc: Optional[CountryCode] = None, cache_size: int = 16 * 1024 * 1024):
+        source = source.rstrip('/\\')
+        self.is_apk = not os.path.isdir(source)
+        self.name = os.path.basename(os.path.splitext(source)[0] if self.is_apk else source)
+        self.cc = cc if cc is not None else version_cc(self.name)
+        self.cache_size = cache_size
+        self.lock = threading.Lock()
+        self.readers: dict[str, PackReader] = {}
+        self.stack = contextlib.ExitStack()
+
+        if self.is_apk:
+            self.apk = self.stack.enter_context(open_inner_apk(source))
+            self.members = {
+                os.path.basename(info.filename): info
+                for info in self.apk.zip.infolist()
+                if os.path.dirname(info.filename) == 'assets'
+            }
+            files = list(self.members)
+        else:
+            self.assets = os.path.join(source, 'assets')
+            files = os.listdir(self.assets)
+        self.pack_names = sorted(
+            name for name, ext in map(os.path.splitext, files) if ext == '.pack' and f'{name}.list' in files
+        )
+
+    @staticmethod
+    def find(version: str, extracted_dir: str = EXTRACTED_DIR, apk_dir: str = APK_DIR, **kwargs) -> "VersionFS":
+        """`version` (e.g. en-15.0) from its extracted folder if there is one, otherwise its apk."""
+        extracted = os.path.join(extracted_dir, version)
+        if os.path.isdir(extracted):
+            return VersionFS(extracted, **kwargs)
+        return VersionFS(os.path.join(apk_dir, f'{version}.apk'), **kwargs)
+
+    def __enter__(self) -> "VersionFS":
+        return self
+
+    def __exit__(self, *_):
+        self.close()
+
+    def close(self):
+        for reader in self.readers.values():
+            reader.close()
+        self.readers.clear()
+        self.stack.close()
+
+    @property
+    def root(self) -> "VersionPath":
+        return VersionPath(self, ())
+
+    def __truediv__(self, other: str) -> "VersionPath":
+        return self.root / other
+
+    def packs(self) -> list[str]:
+        return list(self.pack_names)
+
+    def reader(self, pack: str) -> PackReader:
+        """The reader for `pack`, opened the first time it is needed."""
+        with self.lock:
+            if pack not in self.readers:
+                if pack not in self.pack_names:
+                    raise FileNotFoundError(f'{self.name}/{pack}')
+                if self.is_apk:
+                    with self.apk.member(self.members[f'{pack}.list']) as list_view:
+                        list_data = bytes(list_view)
+                    pack_data = self.stack.enter_context(self.apk.member(self.members[f'{pack}.pack']))
+                else:
+                    list_data = open_file_b(os.path.join(self.assets, f'{pack}.list'))
+                    pack_data = self.stack.enter_context(map_file(os.path.join(self.assets, f'{pack}.pack')))
+                self.readers[pack] = PackReader(list_data, pack_data, pack, self.cc, self.cache_size)
+            return self.readers[pack]
+
+
+def match_parts(pattern: tuple[str, ...], parts: tuple[str, ...]) -> bool:
+    """Whether `parts` matches the glob `pattern`, where `**` is any number of parts."""
+    if not pattern:
+        return not parts
+    if pattern[0] == '**':
+        return any(match_parts(pattern[1:], parts[i:]) for i in range(len(parts) + 1))
+    return bool(parts) and fnmatch.fnmatchcase(parts[0], pattern[0]) and match_parts(pattern[1:], parts[1:])
+
+
+def could_match(pattern: tuple[str, ...], parts: tuple[str, ...]) -> bool:
+    """Whether something under `parts` could match the glob `pattern`."""
+    if not parts or (pattern and pattern[0] == '**'):
+        return True
+    return bool(pattern) and fnmatch.fnmatchcase(parts[0], pattern[0]) and could_match(pattern[1:], parts[1:])
+
+
+class VersionPath:
+    """
+    A path in a `VersionFS`, with the parts of `pathlib.Path` that make
+    sense for a read-only tree: the root holds a folder per pack, which holds
+    that pack's files.
+    """
+
+    def __init__(self, fs: VersionFS, parts: tuple[str, ...]):
+        self.fs = fs
+        self.parts = parts
+
+    def __str__(self) -> str:
+        return '/'.join((self.fs.name, *self.parts))
+
+    def __repr__(self) -> str:
+        return f'VersionPath({str(self)!r})'
+
+    def __eq__(self, other: object) -> bool:
+        return isinstance(other, VersionPath) and other.fs is self.fs and other.parts == self.parts
+
+    def __hash__(self) -> int:
+        return hash((id(self.fs), self.parts))
+
+    def __lt__(self, other: "VersionPath") -> bool:
+        return self.parts < other.parts
+
+    def __truediv__(self, other: str) -> "VersionPath":
+        return self.joinpath(other)
+
+    def joinpath(self, *others: str) -> "VersionPath":
+        parts = list(self.parts)
+        for other in others:
+            for part in other.replace('\\', '/').split('/'):
+                if part == '..':
+                    if parts:
+                        parts.pop()
+                elif part not in ('', '.'):
+                    parts.append(part)
+        return VersionPath(self.fs, tuple(parts))
+
+    @property
+    def name(self) -> str:
+        return self.parts[-1] if self.parts else ''
+
+    @property
+    def suffix(self) -> str:
+        return os.path.splitext(self.name)[1]
+
+    @property
+    def stem(self) -> str:
+        return os.path.splitext(self.name)[0]
+
+    @property
+    def parent(self) -> "VersionPath":
+        return VersionPath(self.fs, self.parts[:-1])
+
+    def is_dir(self) -> bool:
+        return len(self.parts) == 0 or (len(self.parts) == 1 and self.parts[0] in self.fs.pack_names)
+
+    def is_file(self) -> bool:
+        return len(self.parts) == 2 and self.parts[0] in self.fs.pack_names and self.parts[1] in self.fs.reader(self.parts[0])
+
+    def exists(self) -> bool:
+        return self.is_dir() or self.is_file()
+
+    def iterdir(self) -> Iterator["VersionPath"]:
+        if not self.is_dir():
+            raise NotADirectoryError(str(self))
+        if not self.parts:
+            names = self.fs.packs()
+        else:
+            names = self.fs.reader(self.parts[0]).names()
+        for name in names:
+            yield VersionPath(self.fs, (*self.parts, name))
+
+    def walk(self) -> Iterator["VersionPath"]:
+        """Every path under this one, folders before their contents."""
+        for child in self.iterdir():
+            yield child
+            if child.is_dir():
+                yield from child.walk()
+
+    def glob(self, pattern: str) -> Iterator["VersionPath"]:
+        """
+        Paths under this one matching `pattern`, e.g. `*/stage*.csv` or
+        `**/*.png`. Only packs the pattern can match are looked in.
+        """
+        pattern_parts = tuple(part for part in pattern.replace('\\', '/').split('/') if part)
+        depth = len(self.parts)
+
+        def search(path: VersionPath) -> Iterator[VersionPath]:
+            for child in path.iterdir():
+                if match_parts(pattern_parts, child.parts[depth:]):
+                    yield child
+                if child.is_dir() and could_match(pattern_parts, child.parts[depth:]):
+                    yield from search(child)
+
+        return search(self)
+
+    def rglob(self, pattern: str) -> Iterator["VersionPath"]:
+        return self.glob('**/' + pattern)
+
+    def read_bytes(self) -> bytes:
+        if not self.is_file():
+            raise FileNotFoundError(str(self))
+        return self.fs.reader(self.parts[0]).read(self.parts[1])
+
+    def read_text(self, encoding: str = 'utf-8', errors: Optional[str] = None) -> str:
+        return self.read_bytes().decode(encoding, errors or 'strict')
+
+    def open(self, mode: str = 'r', encoding: Optional[str] = 'utf-8', errors: Optional[str] = None, newline: Optional[str] = None) -> IO:
+        """Open for reading, in text mode by default like `pathlib.Path.open`."""
+        if any(c in mode for c in 'wax+'):
+            raise io.UnsupportedOperation(f'{self} is read-only')
+        data = io.BytesIO(self.read_bytes())
+        if 'b' in mode:
+            return data
+        return io.TextIOWrapper(data, encoding=encoding, errors=errors, newline=newline)
+
+
+class PackDiff(NamedTuple):
+    """The entries of a pack added, removed and changed between two versions."""
+
+    added: list[str]
+    removed: list[str]
+    modified: list[str]
+
+    def __bool__(self) -> bool:
+        return bool(self.added or self.removed or self.modified)
+
+
+def same_cipher(old: PackReader, new: PackReader) -> bool:
+    """Whether the same file is encrypted to the same bytes in both packs."""
+    if old.cipher.passthrough or new.cipher.passthrough:
+        return old.cipher.passthrough == new.cipher.passthrough
+    return (old.cipher.key, old.cipher.iv) == (new.cipher.key, new.cipher.iv)
+
+
+def diff_pack(old: Optional[PackReader], new: Optional[PackReader], name: str = '') -> PackDiff:
+    """
+    Compare two versions of a pack, either of which may be missing, by their
+    lists. Entries in both are compared by length and then by the hash of
+    their encrypted bytes, so nothing is decrypted unless the packs are
+    encrypted with different keys.
+    """
+    old_names = old.index.positions() if old is not None else {}
+    new_names = new.index.positions() if new is not None else {}
+    added = [entry for entry in new_names if entry not in old_names]
+    removed = [entry for entry in old_names if entry not in new_names]
+    common = [entry for entry in new_names if entry in old_names]
+    if old is None or new is None:
+        return PackDiff(added, removed, [])
+
+    compare_encrypted = same_cipher(old, new)
+    modified = []
+    with metrics.span('diff', name, total_count=len(common)) as span:
+        for entry in common:
+            (_, old_length), (_, new_length) = old.index.find(entry), new.index.find(entry)
+            if old_length != new_length:
+                modified.append(entry)
+            elif compare_encrypted:
+                if old.encrypted_hash(entry) != new.encrypted_hash(entry):
+                    modified.append(entry)
+            elif old.read(entry) != new.read(entry):
+                modified.append(entry)
+            span.add(bytes=new_length, count=1)
+    return PackDiff(added, removed, modified)
+
+
+def diff_versions(old: VersionFS, new: VersionFS, jobs: int = 1) -> dict[str, PackDiff]:
+    """`diff_pack` for every pack in either version, `jobs` packs at a time."""
+    packs = sorted(set(old.pack_names) | set(new.pack_names))
+
+    def diff(pack: str) -> PackDiff:
+        old_reader = old.reader(pack) if pack in old.pack_names else None
+        new_reader = new.reader(pack) if pack in new.pack_names else None
+        return diff_pack(old_reader, new_reader, pack)
+
+    with ThreadPoolExecutor(jobs) as executor:
+        return dict(zip(packs, executor.map(diff, packs)))